@@ -1,13 +1,19 @@
 from openai import OpenAI
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from fake_useragent import UserAgent
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from urllib.parse import urlparse
 
+from page_cache import page_cache
+from html_extract import extract_text
+from search_cache import search_cache
+from passages import split_passages, select_passages
+
+import asyncio
 import config
+import functools
+import httpx
 import logging
-import requests
 import random
 import time
 import logging
@@ -23,6 +29,8 @@ openai = OpenAI(
 class Websearch:
     # Initialize user agent generator at class level
     _ua = UserAgent()
+    # Page fetches run here rather than in the loop default executor, so asyncio.run does not wait for pages past the deadline
+    _fetch_executor = ThreadPoolExecutor(max_workers=config.WEB_FETCH_CONCURRENCY * 4, thread_name_prefix="web-fetch")
     
     @staticmethod
     def generate_search_query(question: str) -> str:
@@ -60,56 +68,42 @@ class Websearch:
             return ""
 
     @staticmethod
-    def search_web(query, limit=10, max_tokens=80000) -> dict:
+    def search_web(query, limit=10, max_tokens=config.WEB_CONTEXT_TOKENS) -> dict:
         """
-        Search the web and return summarized content fitting within the context limit.
+        Search the web and return the page passages most relevant to the query, fitting within max_tokens.
         """
         try:
-            formatted_query = Websearch.generate_search_query(query)
+            formatted_query = search_cache.rewrite(query, Websearch.generate_search_query)
             log.info(f"Formatted query: {formatted_query}")
             print(formatted_query)
-            headers = {
-                "Accept": "application/json",
-                "X-Subscription-Token": config.BRAVE_API_KEY
-            }
-
-            response = requests.get(
-                "https://api.search.brave.com/res/v1/web/search",
-                params={"q": formatted_query, "count": limit},
-                headers=headers
-            )
-
-            if not response.ok:
-                raise Exception(f"HTTP error {response.status_code}")
-
-            data = response.json()
+            data = search_cache.search(formatted_query, count=limit)
             web_search_results = []
             urls_seen = set()
             profiles = []
-
-            total_tokens = 0
+            results = []
 
             for result in data.get("web", {}).get("results", []):
                 url = result.get("url")
                 if not url or url in urls_seen:
                     continue
-
                 urls_seen.add(url)
-                print(f'{len(urls_seen)}/{len(data.get("web", {}).get("results", []))}')
-                
-                # Add small delay between requests to be polite
-                time.sleep(random.uniform(0.5, 1.5))
-                
-                page_content = Websearch.get_page_content(url, max_tokens)
+                results.append(result)
 
-                if page_content.startswith("Error") or page_content.startswith("Timeout"):
-                    continue
+            pages = asyncio.run(Websearch.fetch_pages([result["url"] for result in results], config.WEB_PAGE_MAX_TOKENS))
+            fetched = [(result, page_content) for result, page_content in zip(results, pages)
+                       if page_content is not None and not page_content.startswith("Error") and not page_content.startswith("Timeout")]
 
-                content_tokens = len(page_content) // 4
-                if total_tokens + content_tokens > max_tokens:
-                    break
+            # Rank the passages of all pages against the question and the search query, keep the best within the budget
+            passages = [split_passages(page_content, config.WEB_PASSAGE_WORDS) for _, page_content in fetched]
+            selected = select_passages(f"{query} {formatted_query}", passages, max_tokens, config.WEB_PASSAGES_PER_PAGE)
+            total_tokens = 0
 
-                total_tokens += content_tokens
+            for (result, _), page_passages, indices in zip(fetched, passages, selected):
+                if not indices:
+                    continue
+                url = result.get("url")
+                page_content = "\n...\n".join(page_passages[i] for i in indices)
+                total_tokens += len(page_content) // 4
                 trimmed_profile = {
                     "title": result.get("title"),
                     "description": result.get("description"),
@@ -124,6 +118,7 @@ class Websearch:
                     f"<source>{url}</source>\n<page_content>\n{page_content}\n</page_content>"
                 )
 
+            log.info(f"==========Passages of {len(fetched)} pages, {total_tokens} tokens==========")
             log.info(f"==========Profiles fetched: {len(profiles)}==========")
             formatted_search_results = "\n".join(web_search_results)
             return {"result": formatted_search_results, "profiles": profiles}
@@ -132,6 +127,52 @@ class Websearch:
             log.exception(f"Exception in search_web: {str(e)}")
             return {"result": "", "profiles": []}
 
+    @staticmethod
+    async def fetch_pages(urls: list, max_tokens: int,
+                          concurrency: int = config.WEB_FETCH_CONCURRENCY,
+                          per_domain: int = config.WEB_FETCH_PER_DOMAIN,
+                          deadline: float = config.WEB_FETCH_DEADLINE) -> list:
+        """
+        Fetch the pages concurrently, at most concurrency at once and per_domain at once on the same domain.
+        Requests to a domain already fetched in this search keep the small polite delay. Each page gets a
+        single attempt whose timeout ends with the deadline, so no worker thread outlives the search.
+        Args:
+            urls (list): Page urls, in result order.
+            max_tokens (int): Token budget of the search, passed to get_page_content.
+            deadline (float): Seconds after which the pages still loading are given up.
+        Returns:
+            list: Page content of each url in the same order, None for the pages past the deadline.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        domains = {}
+        visited = set()
+        loop = asyncio.get_running_loop()
+        deadline_at = loop.time() + deadline
+
+        async def fetch(url):
+            domain = urlparse(url).netloc
+            domain_semaphore = domains.setdefault(domain, asyncio.Semaphore(per_domain))
+            async with semaphore, domain_semaphore:
+                if domain in visited:
+                    await asyncio.sleep(random.uniform(0.5, 1.5))
+                visited.add(domain)
+                remaining = deadline_at - loop.time()
+                if remaining <= 0:
+                    return None
+                fetch_page = functools.partial(Websearch.get_page_content, url, max_tokens,
+                                               timeout=min(15, remaining), retry=False)
+                return await loop.run_in_executor(Websearch._fetch_executor, fetch_page)
+
+        tasks = [asyncio.create_task(fetch(url)) for url in urls]
+        if not tasks:
+            return []
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+        for task in pending:
+            task.cancel()
+        if pending:
+            log.warning(f"{len(pending)}/{len(tasks)} pages not fetched within {deadline}s")
+        return [task.result() if task in done and not task.exception() else None for task in tasks]
+
     @staticmethod
     def _get_browser_headers(referer=None):
         """
@@ -141,7 +182,6 @@ class Websearch:
             "User-Agent": Websearch._ua.random,
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
             "Accept-Language": "en-US,en;q=0.9",
-            "Accept-Encoding": "gzip, deflate, br",
             "DNT": "1",
             "Connection": "keep-alive",
             "Upgrade-Insecure-Requests": "1",
@@ -161,103 +201,38 @@ class Websearch:
         return headers
 
     @staticmethod
-    def _create_robust_session():
-        """
-        Create a requests session with retry strategy.
-        """
-        session = requests.Session()
-        
-        # Setup retry strategy for temporary failures
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
-            allowed_methods=["HEAD", "GET", "OPTIONS"]
-        )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        session.mount("http://", adapter)
-        session.mount("https://", adapter)
-        
-        return session
-
-    @staticmethod
-    def get_page_content(url, max_tokens, referer="https://www.google.com/"):
+    def get_page_content(url, max_tokens, referer="https://www.google.com/", timeout=15, retry=True):
         """
         Extracts text content from a given URL with enhanced 403 protection.
         
         Args:
             url: The URL to scrape
-            max_tokens: Maximum token limit
+            max_tokens: Maximum tokens (chars/4) of the page text
             referer: Referer header (default: Google)
+            timeout: Seconds of the request
+            retry: Retry failed requests and 403 answers, False for a single attempt within timeout
         """
-        session = None
         try:
-            # Create session with retry logic
-            session = Websearch._create_robust_session()
-            
             # Get realistic headers
             headers = Websearch._get_browser_headers(referer=referer)
             
-            token_len = int(max_tokens / 10)
-            log.info(f"==========Token Len: {token_len}==========")
-            
-            # Make request with enhanced headers
-            response = session.get(
-                url, 
-                headers=headers,
-                timeout=15,  # Increased timeout
-                allow_redirects=True
-            )
-            response.raise_for_status()
+            # Fetch through the page cache, the whole page text is cached and cut to max_tokens here
+            text_content = page_cache.fetch_text(url, "text", extract_text, headers=headers,
+                                                 timeout=timeout, retry=retry)
+            return text_content[:max_tokens * 4]
 
-            # Parse content
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Remove unwanted elements
-            for element in soup(['script', 'style', 'header', 'footer', 'nav', 'iframe', 'noscript']):
-                element.decompose()
-
-            # Extract text
-            text_content = soup.get_text(separator='\n').strip()
-            
-            # Clean up whitespace
-            lines = [line.strip() for line in text_content.splitlines() if line.strip()]
-            text_content = '\n'.join(lines)
-            
-            # Tokenize and limit
-            words = text_content.split()
-            words = words[:token_len] if len(words) > token_len else words
-            
-            return ' '.join(words)
-
-        except requests.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             status_code = e.response.status_code
             
-            if status_code == 403:
+            if status_code == 403 and retry:
                 # Try one more time with different user agent and referer
                 try:
                     log.warning(f"403 error for {url}, retrying with different headers...")
                     time.sleep(random.uniform(1, 2))
                     
                     headers = Websearch._get_browser_headers(referer="https://www.bing.com/")
-                    response = session.get(
-                        url,
-                        headers=headers,
-                        timeout=15,
-                        allow_redirects=True
-                    )
-                    response.raise_for_status()
-                    
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    for element in soup(['script', 'style', 'header', 'footer', 'nav']):
-                        element.decompose()
-                    
-                    text_content = soup.get_text(separator='\n').strip()
-                    words = text_content.split()
-                    words = words[:token_len] if len(words) > token_len else words
-                    
-                    return ' '.join(words)
+                    text_content = page_cache.fetch_text(url, "text", extract_text, headers=headers, timeout=timeout)
+                    return text_content[:max_tokens * 4]
                     
                 except Exception:
                     print(f"403 Forbidden for {url} - Site may block scrapers. Skipping.")
@@ -271,18 +246,14 @@ class Websearch:
                 print(f"HTTP Error {status_code} for {url}")
                 return f"Error: HTTP {status_code}"
 
-        except requests.Timeout:
+        except httpx.TimeoutException:
             print(f"Timeout: Unable to fetch content from {url}")
             return "Timeout: Content could not be fetched."
 
-        except requests.RequestException as e:
+        except httpx.HTTPError as e:
             print(f"Error fetching {url}: {e}")
             return f"Error fetching content: {str(e)}"
         
         except Exception as e:
             print(f"Unexpected error for {url}: {e}")
             return f"Error: {str(e)}"
-        
-        finally:
-            if session:
-                session.close()
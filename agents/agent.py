@@ -9,6 +9,7 @@ import asyncio
 from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
 from memory import Memory
+from model_tier import tier_usage
 from utility import pretty_print
 from schemas import executorResult
 
@@ -51,6 +52,9 @@ class Agent():
         self.orgn = ""
         self.uid = ""
         self.bot_key = ""
+        self.usage_type = "chat" # token_metrics usage_type of the agent llm calls
+        self.complexity = None # router complexity estimation of the current query, used for model tiering
+        self.bot_model = None # model configured on the bot, served as the large tier model
         self.executor = ThreadPoolExecutor(max_workers=1)
     
     @property
@@ -165,24 +169,30 @@ class Agent():
         end_idx = text.rfind(end_tag)+8
         return text[start_idx:end_idx]
     
-    async def llm_request(self) -> Tuple[str, str]:
+    async def llm_request(self, purpose: str = None) -> Tuple[str, str]:
         """
         Asynchronously ask the LLM to process the prompt.
+        Args:
+            purpose (str, optional): What the call is for (eg: planning, final_answer, link_selection), used to pick the model tier.
         """
         self.status_message = "Thinking..."
         loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.executor, self.sync_llm_request)
+        return await loop.run_in_executor(self.executor, self.sync_llm_request, purpose)
     
-    def sync_llm_request(self) -> Tuple[str, str]:
+    def sync_llm_request(self, purpose: str = None) -> Tuple[str, str]:
         """
         Ask the LLM to process the prompt and return the answer and the reasoning.
         """
         memory = self.memory.get()
-        thought = self.llm.respond(memory, self.verbose)
+        tier, model = self.llm.select_model(purpose, self.complexity, self.bot_model)
+        start = time.time()
+        thought = self.llm.respond(memory, self.verbose, model=model,
+                                   usage=(self.orgn, self.usage_type, self.bot_key))
+        tier_usage.record(tier, model, purpose, self.complexity, time.time() - start)
 
         reasoning = self.extract_reasoning_text(thought)
         answer = self.remove_reasoning_text(thought)
-        self.memory.push('assistant', answer)
+        self.memory.push('assistant', answer, model_used=model)
         return answer, reasoning
     
     async def wait_message(self, speech_module):
@@ -35,6 +35,7 @@ class BrowserAgent(Agent):
         self.search_history = []
         self.navigable_links = []
         self.last_action = Action.NAVIGATE.value
+        self.prompt_purpose = None
         self.notes = []
         self.date = self.get_today_date()
         self.logger = Logger("browser_agent.log")
@@ -78,6 +79,7 @@ class BrowserAgent(Agent):
         return "\n".join([f"[{i}] {link}" for i, link in enumerate(self.navigable_links) if link not in self.search_history])
 
     def make_newsearch_prompt(self, prompt: str, search_result: dict) -> str:
+        self.prompt_purpose = "link_selection"
         search_choice = self.stringify_search_results(search_result)
         self.logger.info(f"Search results: {search_choice}")
         return f"""
@@ -90,6 +92,7 @@ class BrowserAgent(Agent):
         """
     
     def make_navigation_prompt(self, user_prompt: str, page_text: str) -> str:
+        self.prompt_purpose = None
         remaining_links = self.get_unvisited_links() 
         remaining_links_text = remaining_links if remaining_links is not None else "No links remaining, do a new search." 
         inputs_form = self.browser.get_form_inputs()
@@ -180,7 +183,7 @@ class BrowserAgent(Agent):
     async def llm_decide(self, prompt: str, show_reasoning: bool = False) -> Tuple[str, str]:
         animate_thinking("Thinking...", color="status")
         self.memory.push('user', prompt)
-        answer, reasoning = await self.llm_request()
+        answer, reasoning = await self.llm_request(purpose=self.prompt_purpose)
         self.last_reasoning = reasoning
         if show_reasoning:
             pretty_print(reasoning, color="failure")
@@ -343,7 +346,7 @@ class BrowserAgent(Agent):
 
         animate_thinking(f"Thinking...", color="status")
         mem_begin_idx = self.memory.push('user', self.search_prompt(user_prompt))
-        ai_prompt, reasoning = await self.llm_request()
+        ai_prompt, reasoning = await self.llm_request(purpose="search_query")
         if Action.REQUEST_EXIT.value in ai_prompt:
             pretty_print(f"Web agent requested exit.\n{reasoning}\n\n{ai_prompt}", color="failure")
             return ai_prompt, "" 
@@ -427,7 +430,7 @@ class BrowserAgent(Agent):
         prompt = self.conclude_prompt(user_prompt)
         mem_last_idx = self.memory.push('user', prompt)
         self.status_message = "Summarizing findings..."
-        answer, reasoning = await self.llm_request()
+        answer, reasoning = await self.llm_request(purpose="final_answer")
         pretty_print(answer, color="output")
         self.status_message = "Ready"
         self.last_answer = answer
@@ -156,7 +156,7 @@ class PlannerAgent(Agent):
         while not ok:
             animate_thinking("Thinking...", color="status")
             self.memory.push('user', prompt)
-            answer, reasoning = await self.llm_request()
+            answer, reasoning = await self.llm_request(purpose="planning")
             if "NO_UPDATE" in answer:
                 return []
             agents_tasks = self.parse_agent_tasks(answer)
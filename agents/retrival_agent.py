@@ -4,14 +4,16 @@ from agents.agent import Agent
 from sqlalchemy.orm import Session
 from utility import animate_thinking
 from concurrent.futures import ThreadPoolExecutor
-from langchain_community.vectorstores import Cassandra
-from models import CreatingBot, KnowledgeBase, KBIndexIDs
+from retrieval_plan import retrieval_plans, RetrievalPlan
+from answer_cache import answer_cache
 from langchain_community.embeddings import DeepInfraEmbeddings
-from utility import get_table_names
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy import func, String
-from sqlalchemy import select, exists, literal_column
+from utility import get_table_names, TTLCache
 from WebSearcher import Websearch
+from token_usage import usage_recorder
+from vector_store import vector_stores
+from local_index import local_indexes
+from bm25_index import bm25_indexes
+from retrieval import merge_results, remove_near_duplicates, pack_context, search_table, reciprocal_rank_fusion, CrossEncoderReranker
 
 import config, logging, cassio
 
@@ -23,6 +25,8 @@ embeddings = DeepInfraEmbeddings(
     model_id=config.BAAI_MODEL_ID,
     deepinfra_api_token=config.DEEPINFRA_API_TOKEN,
 )
+query_embeddings = TTLCache(max_entries=config.QUERY_EMBEDDING_CACHE_SIZE, ttl=config.QUERY_EMBEDDING_CACHE_TTL)
+reranker = CrossEncoderReranker(config.KB_RERANK_MODEL) if config.KB_RERANK_MODEL else None
 
 class ReterivalAgent(Agent):
     def __init__(self, name, prompt_path, provider, cid, verbose=False):
@@ -34,94 +38,169 @@ class ReterivalAgent(Agent):
         } # No tools for the casual agent
         self.role = "retrive"
         self.type = "retrival_agent"
+        self.usage_type = "knowledge_base"
         self.memory = Memory(self.load_prompt(prompt_path),
                                 memory_compression=False,
                                 cid=cid,
                                 model_provider=provider.get_model_name())
         
-    async def retrive_knowledge(self, table_names: list[str], query, top_k:int = 10) -> str:
+    async def embed_query(self, query: str) -> list[float]:
+        """
+        Embed the query once for every table searched, identical queries reuse the cached vector.
+        """
+        key = (config.BAAI_MODEL_ID, query)
+        vector = query_embeddings.get(key)
+        if vector is None:
+            vector = await embeddings.aembed_query(query)
+            query_embeddings.put(key, vector)
+            usage_recorder.record(self.orgn, self.usage_type, self.bot_key,
+                                  embed_tokens=len(query) // 4)
+        return vector
+
+    async def retrive_knowledge(self, table_names: list[str], query, top_k:int = config.KB_TOP_K,
+                                row_ids: dict[str, set[str]] = None) -> str:
+        """
+        Search every table with the query vector and build the context from the global best chunks.
+        The per table results are merged by similarity and fused with the merged BM25 results when hybrid
+        search is on. Near duplicates are dropped before keeping top_k, the optional reranker reorders
+        them and the result is packed into KB_CONTEXT_TOKENS.
+        Tables listed in row_ids only return those rows.
+        """
         try:
-            async def run_task(table_name):
-                print(f"Searching Vector: {table_name}")
-                astra_vector_store = Cassandra(
-                    table_name=table_name,
-                    embedding=embeddings,
-                    session=None,
-                    keyspace="default_keyspace",
-                )
-                # Perform the retrieval by row ID
-                result = await astra_vector_store.asimilarity_search(query=query, k=top_k)
+            query_vector = await self.embed_query(query)
+            semaphore = asyncio.Semaphore(config.KB_SEARCH_CONCURRENCY)
+
+            async def vector_search(table_name, table_row_ids):
+                try:
+                    result = await asyncio.to_thread(local_indexes.search, table_name, query_vector, top_k, table_row_ids)
+                except Exception as e:
+                    log.error(f"Local index search of {table_name} failed, using Astra: {str(e)}")
+                    result = None
+                if result is not None:
+                    print(f"Local Result Len: {len(result)}")
+                    return result
+                astra_vector_store = await vector_stores.aget(table_name, embeddings)
+                try:
+                    result = await search_table(astra_vector_store, query_vector, top_k,
+                                                row_ids=table_row_ids,
+                                                direct_limit=config.KB_FILTER_DIRECT_LIMIT,
+                                                oversample=config.KB_FILTER_OVERSAMPLE,
+                                                max_fetch=config.KB_FILTER_MAX_FETCH)
+                except Exception:
+                    vector_stores.invalidate(table_name)
+                    raise
                 print(f"Result Len: {len(result)}")
                 return result
 
-        # Execute tasks concurrently using ThreadPoolExecutor
-            query_text = ""
+            async def lexical_search(table_name, table_row_ids):
+                try:
+                    return await asyncio.to_thread(bm25_indexes.search, table_name, query, top_k, table_row_ids)
+                except Exception as e:
+                    log.error(f"BM25 search of {table_name} failed: {str(e)}")
+                    return None
+
+            async def run_task(table_name):
+                async with semaphore:
+                    print(f"Searching Vector: {table_name}")
+                    table_row_ids = (row_ids or {}).get(table_name)
+                    if not bm25_indexes.enabled:
+                        return await vector_search(table_name, table_row_ids), None
+                    # a failed branch must not lose the results of the other one
+                    return await asyncio.gather(
+                        vector_search(table_name, table_row_ids),
+                        lexical_search(table_name, table_row_ids),
+                        return_exceptions=True
+                    )
+
             tasks = [run_task(table_name) for table_name in table_names]
-            results = await asyncio.gather(*tasks)
-            all_docs=[]
-            for result in results:
-                if isinstance(result, list):
-                    all_docs.extend(result)
-                else:
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+            vector_results, lexical_results = [], []
+            for table_name, result in zip(table_names, results):
+                if isinstance(result, BaseException):
                     log.error(f"Error processing task: {result}")
-            print(f"All Docs Len: {len(all_docs)}")
-            for res in all_docs:
-                print(res)
-                query_text = query_text + f"{res}\n"
-            print(f"Len of Query Text: {len(query_text)}")
+                    continue
+                vector_result, lexical_result = result
+                if isinstance(vector_result, BaseException):
+                    log.error(f"Vector search of {table_name} failed: {vector_result}")
+                elif vector_result:
+                    vector_results.append(vector_result)
+                if lexical_result and not isinstance(lexical_result, BaseException):
+                    lexical_results.append(lexical_result)
+            # Similarities are comparable across tables, per table ranks are not: each scorer is merged into
+            # one global ranking first, then the two global rankings are fused
+            scored_docs = merge_results(vector_results)
+            if lexical_results:
+                scored_docs = reciprocal_rank_fusion([scored_docs, merge_results(lexical_results)])
+            # dedup the whole pool before cutting, duplicates must not take the place of distinct chunks
+            candidates = remove_near_duplicates(scored_docs, threshold=config.KB_DEDUP_THRESHOLD,
+                                                limit=top_k * 2 if reranker else top_k)
+            if reranker:
+                candidates = await asyncio.to_thread(reranker.rerank, query, candidates)
+            query_text = pack_context(candidates[:top_k], max_tokens=config.KB_CONTEXT_TOKENS)
+            print(f"Kept {min(len(candidates), top_k)} chunks, len of Query Text: {len(query_text)}")
             return query_text
         except Exception as e:
             log.error(f"Error getting chunk from {table_names}: {str(e)}")
             return None
     
+    async def search_web(self, prompt: str) -> str:
+        """Web search branch, the blocking search runs in a worker thread."""
+        search = await asyncio.to_thread(Websearch.search_web, prompt)
+        return search.get("result")
+
+    async def search_knowledge(self, prompt: str, plan: RetrievalPlan) -> str:
+        """Knowledge base branch: search the tables of the bot knowledge bases."""
+        print("Getting Table names")
+        unique_table_names = await get_table_names(self.orgn, plan.kb_ids, self.uid)
+        print(f"Getting context: {unique_table_names}")
+        context = await self.retrive_knowledge(unique_table_names, prompt, row_ids=plan.row_ids)
+        print(f"Context: {context}")
+        return context
+
+    async def run_branch(self, coro, timeout: float, name: str) -> str:
+        """
+        Await a retrieval branch with its own deadline, an expired or failed branch gives an empty result.
+        A thread started by the branch keeps running after the deadline but its result is ignored.
+        """
+        try:
+            return await asyncio.wait_for(coro, timeout=timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"{name} exceeded its {timeout}s deadline, answering without it")
+        except Exception as e:
+            log.error(f"{name} failed: {str(e)}")
+        return ""
+
     async def process(self, prompt: str, bot_key: str = None, db: Session | None = None) -> str:
         if not bot_key and not db:
             raise "Need DB And Bot key to start retrival"
-        myKbs = []
-        api = db.query(CreatingBot).filter(CreatingBot.apikey == bot_key).first()
-
-        if api.training_files:
-            myKbs = api.training_files.split(",")
-        context = ""
-        print(myKbs)
-        result_text = ""
-        if api.default_websearch:
-            web = Websearch()
-            search = web.search_web(prompt)
-            result_text = search.get("result")
-        if myKbs:
-            myKbIds = [int(i) for i in myKbs]
-            print(f"Entering Kb, {myKbIds}")
-            data = db.query(KnowledgeBase).filter(KnowledgeBase.id.in_(myKbIds)).all()
-            print(len(data))
-            doc_names = [d.file_name for d in data if d.file_name is not None]
-            print(doc_names)
-            K = KBIndexIDs
-            elem = func.jsonb_array_elements_text(K.index_ids).table_valued("value", type_=String, joins_implicitly=True)
-            subq = (
-                select(literal_column("1"))
-                .select_from(elem)
-                .where(elem.c.value.in_(doc_names))
-                .correlate(K)  # ensure the subquery is correlated with KBIndexIDs
-            )
-
-            filtered = (
-                db.query(KBIndexIDs)
-                .filter(exists(subq))
-                .all()
-            )
-            filtered_doc_ids = [str(f.id) for f in filtered]
-            filter = {
-                "row_id": {
-                    "$in": filtered_doc_ids
-                }
-            }
-            kb_ids = list(set(kb.kb_id for kb in data if kb.kb_id is not None))
-            print("Getting Table names")
-            unique_table_names = await get_table_names(self.orgn, kb_ids, self.uid)
-            print(f"Getting context: {unique_table_names}")
-            context = await self.retrive_knowledge(unique_table_names, prompt)
-            print(f"Context: {context}")
+        self.bot_key = bot_key
+        plan = await asyncio.to_thread(retrieval_plans.get, bot_key, db)
+        if plan is None:
+            raise Exception(f"No bot found for key {bot_key}")
+        self.bot_model = plan.model
+        print(plan.kb_ids)
+        scope = (bot_key, self.orgn, self.uid if "private" in plan.kb_ids else "")
+        # a follow-up question depends on the earlier turns, only first questions use the answer cache
+        first_turn = all(msg['role'] == 'system' for msg in self.memory.get())
+        try:
+            question_vector = await self.embed_query(prompt)
+        except Exception as e:
+            log.error(f"Question embedding failed, skipping the answer cache: {str(e)}")
+            question_vector = None
+        cached = answer_cache.get(scope, question_vector, plan.fingerprint) if question_vector and first_turn else None
+        if cached:
+            self.memory.push('user', prompt, query=prompt)
+            self.memory.push('assistant', cached.answer)
+            self.last_answer = cached.answer
+            self.status_message = "Ready"
+            return cached.answer, cached.reasoning
+        web_task, kb_task = None, None
+        if plan.default_websearch:
+            web_task = asyncio.create_task(self.run_branch(self.search_web(prompt), config.WEB_SEARCH_TIMEOUT, "Web search"))
+        if plan.has_knowledge:
+            kb_task = asyncio.create_task(self.run_branch(self.search_knowledge(prompt, plan), config.KB_RETRIEVAL_TIMEOUT, "Knowledge retrieval"))
+        result_text = await web_task if web_task else ""
+        context = await kb_task if kb_task else ""
         SYS_PROMPT = """
             You are the best AI assistant designed to answer questions with precision, specificity, and conciseness. Your responses must strictly adhere to the content and question provided by the user.
             Instructions:
@@ -131,11 +210,14 @@ class ReterivalAgent(Agent):
                 4. Focus on directly addressing the question, staying on topic, and being as clear and concise as possible.
                 5. Also consider the prompt given by the user, but do not go beyond the rules above.
         """
-        final_query = f"{api.prompt if api.prompt else SYS_PROMPT} \n User Query: {prompt} \n Context: {context} \n Web Search: {result_text if result_text else None}" 
+        final_query = f"{plan.prompt if plan.prompt else SYS_PROMPT} \n User Query: {prompt} \n Context: {context} \n Web Search: {result_text if result_text else None}" 
         # self.memory.push('user', final_query)
         self.memory.push('user', final_query, context=context, query=prompt)
         animate_thinking("Thinking...", color="status")
-        answer, reasoning = await self.llm_request()
+        answer, reasoning = await self.llm_request(purpose="final_answer")
+        if answer and question_vector and first_turn:
+            answer_cache.put(scope, question_vector, prompt, answer, reasoning, plan.fingerprint,
+                             web_search=plan.default_websearch)
         self.last_answer = answer
         self.status_message = "Ready"
         return answer, reasoning
@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import config
+from logger import Logger
+
+class CachedAnswer:
+    def __init__(self, vector: np.ndarray, question: str, answer: str, reasoning: str, fingerprint: str, ttl: float):
+        self.vector = vector
+        self.question = question
+        self.answer = answer
+        self.reasoning = reasoning
+        self.fingerprint = fingerprint
+        self.expires_at = time.time() + ttl
+        self.last_hit = time.time()
+
+class SemanticAnswerCache:
+    """
+    Per bot cache of final answers keyed by the question embedding.
+    A question whose cosine similarity with a cached question reaches the threshold gets the cached
+    answer, as long as the bot fingerprint (prompt, knowledge bases, indexed documents) is unchanged
+    and the entry did not expire. Entries of bots using web search get a short TTL.
+    """
+    def __init__(self, threshold: float = 0.95, ttl: float = 86400, web_ttl: float = 600, max_entries_per_bot: int = 256):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.web_ttl = web_ttl
+        self.max_entries_per_bot = max_entries_per_bot
+        self.entries: Dict[Tuple, List[CachedAnswer]] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.logger = Logger("answer_cache.log")
+
+    @staticmethod
+    def normalize(vector: list) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) + 1e-12)
+
+    def get(self, scope: Tuple, vector: list, fingerprint: str) -> CachedAnswer | None:
+        """
+        Args:
+            scope (tuple): Cache partition, starts with the bot key.
+            vector (list): Embedding of the question.
+            fingerprint (str): Current fingerprint of the bot retrieval plan.
+        Returns:
+            CachedAnswer | None: The closest valid entry above the threshold.
+        """
+        query = self.normalize(vector)
+        now = time.time()
+        with self.lock:
+            entries = [entry for entry in self.entries.get(scope, [])
+                       if entry.fingerprint == fingerprint and entry.expires_at > now]
+            if scope in self.entries:
+                self.entries[scope] = entries
+            if not entries:
+                self.misses += 1
+                return None
+            similarities = np.stack([entry.vector for entry in entries]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            entry = entries[best]
+            entry.last_hit = now
+            self.hits += 1
+        self.logger.info(f"Answer cache hit for {scope[0]} (similarity {similarities[best]:.3f})")
+        return entry
+
+    def put(self, scope: Tuple, vector: list, question: str, answer: str, reasoning: str,
+            fingerprint: str, web_search: bool = False) -> None:
+        entry = CachedAnswer(self.normalize(vector), question, answer, reasoning, fingerprint,
+                             self.web_ttl if web_search else self.ttl)
+        with self.lock:
+            entries = self.entries.setdefault(scope, [])
+            entries.append(entry)
+            if len(entries) > self.max_entries_per_bot:
+                entries.sort(key=lambda e: e.last_hit)
+                del entries[:len(entries) - self.max_entries_per_bot]
+
+    def invalidate(self, bot_key: str = None) -> None:
+        """Drop the answers of a bot, or of every bot if no bot key is given."""
+        with self.lock:
+            if bot_key is None:
+                self.entries.clear()
+            else:
+                for scope in [scope for scope in self.entries if scope[0] == bot_key]:
+                    del self.entries[scope]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "bots": len(self.entries),
+                "entries": sum(len(entries) for entries in self.entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+answer_cache = SemanticAnswerCache(
+    threshold=config.ANSWER_CACHE_THRESHOLD,
+    ttl=config.ANSWER_CACHE_TTL,
+    web_ttl=config.ANSWER_CACHE_WEB_TTL,
+)
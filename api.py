@@ -1,10 +1,11 @@
 from starlette.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from fastapi import FastAPI, Depends
+from fastapi import FastAPI, Depends, Header, HTTPException
 from sqlalchemy.orm import Session
 from db import SessionLocal
 from time import sleep
+import hmac
 import uuid
 import time
 import json, logging
@@ -13,6 +14,8 @@ import asyncio
 from main import initialize_system
 from schemas import QueryRequest as Query
 from interaction import Interaction
+from retrieval_plan import retrieval_plans
+import config
 
 api = FastAPI()
 interaction_instance: Interaction = None
@@ -27,6 +30,11 @@ def get_db():
     finally:
         db.close()
 
+def require_admin(x_admin_token: str = Header(default="")):
+    """Maintenance routes need the ADMIN_API_TOKEN, they are refused when it is not configured."""
+    if not config.ADMIN_API_TOKEN or not hmac.compare_digest(x_admin_token, config.ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
 api.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 
 api.add_middleware(
@@ -37,6 +45,10 @@ api.add_middleware(
     allow_headers=["*"],
 )
 
+@api.on_event("startup")
+def start_retrieval_plan_sync():
+    retrieval_plans.start()
+
 @api.get("/")
 async def hello():
     return "Agent is working"
@@ -67,6 +79,17 @@ async def agent(query: Query, db: Session = Depends(get_db)):
             print("Generating Answer....")
     return StreamingResponse(stream())
 
+@api.delete("/retrieval_plans/{bot_key}", dependencies=[Depends(require_admin)])
+def invalidate_retrieval_plan(bot_key: str, db: Session = Depends(get_db)):
+    """Called after a bot or one of its knowledge bases changed, every worker drops its cached plan and answers."""
+    retrieval_plans.invalidate(bot_key, db)
+    return {"status": "SUCCESS", "invalidated": bot_key}
+
+@api.delete("/retrieval_plans", dependencies=[Depends(require_admin)])
+def invalidate_retrieval_plans(db: Session = Depends(get_db)):
+    retrieval_plans.invalidate(db=db)
+    return {"status": "SUCCESS", "invalidated": "all"}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("api:api", host="0.0.0.0", port=8844, workers=2)
\ No newline at end of file
@@ -0,0 +1,289 @@
+import heapq
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+import config
+from local_index import diff_remote_table
+from logger import Logger
+from retrieval import ScoredDocument
+from text_tokens import tokenize
+
+logger = Logger("bm25_index.log")
+
+def encode_postings(postings: List[tuple]) -> bytes:
+    """Delta encoded (doc, tf) pairs as varints, zlib compressed."""
+    out = bytearray()
+    previous = 0
+    for doc, tf in postings:
+        for value in (doc - previous, tf):
+            while value >= 0x80:
+                out.append((value & 0x7F) | 0x80)
+                value >>= 7
+            out.append(value)
+        previous = doc
+    return zlib.compress(bytes(out))
+
+def decode_postings(blob: bytes) -> List[tuple]:
+    data = zlib.decompress(blob)
+    values, value, shift = [], 0, 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value, shift = 0, 0
+    postings, doc = [], 0
+    for i in range(0, len(values), 2):
+        doc += values[i]
+        postings.append((doc, values[i + 1]))
+    return postings
+
+class BM25Index:
+    """
+    BM25 inverted index of one KB table, stored in SQLite.
+    Each term has one compressed postings blob. New chunks get increasing doc numbers so they are
+    appended to the existing postings, removed chunks are tombstoned and dropped by compact().
+    Added chunks are buffered and merged into the postings by flush(), so a sync rewrites each
+    term blob once instead of once per fetched batch.
+    """
+    def __init__(self, table_name: str, directory: str, k1: float = 1.2, b: float = 0.75,
+                 max_buffered: int = 2_000_000):
+        self.table_name = table_name
+        self.k1 = k1
+        self.b = b
+        self.max_buffered = max_buffered
+        path = Path(directory) / table_name
+        path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path / "bm25.db", check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc INTEGER PRIMARY KEY,
+                row_id TEXT UNIQUE NOT NULL,
+                length INTEGER NOT NULL,
+                body TEXT,
+                metadata TEXT,
+                live INTEGER NOT NULL DEFAULT 1
+            )
+        """)
+        self.db.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, postings BLOB NOT NULL)")
+        self.db.commit()
+        self.next_doc, self.live_docs, self.total_length, self.dead_docs = self.db.execute(
+            "SELECT COALESCE(MAX(doc) + 1, 0), COALESCE(SUM(live), 0), COALESCE(SUM(length * live), 0), "
+            "COALESCE(SUM(1 - live), 0) FROM docs").fetchone()
+        self.dead = {doc for (doc,) in self.db.execute("SELECT doc FROM docs WHERE live = 0")}
+        self.reset_buffer()
+        self.synced_at = None
+
+    @property
+    def ready(self) -> bool:
+        """True once a full sync completed in this process, the index on disk may be a partial sync."""
+        return self.synced_at is not None
+
+    def reset_buffer(self) -> None:
+        self.buffered_postings = defaultdict(list)
+        self.buffered_count = 0
+        self.buffered_docs = 0
+        self.buffered_length = 0
+
+    def known_ids(self) -> set:
+        with self.lock:
+            return {row_id for (row_id,) in self.db.execute("SELECT row_id FROM docs WHERE live = 1")}
+
+    def add(self, rows: list) -> None:
+        """
+        Index new chunks. They are searchable after flush(), or discard() forgets them.
+        Args:
+            rows (list): dicts with row_id, body_blob and metadata.
+        """
+        if not rows:
+            return
+        with self.lock:
+            docs = []
+            for row in rows:
+                doc = self.next_doc
+                self.next_doc += 1
+                tokens = tokenize(row["body_blob"] or "")
+                for term, tf in Counter(tokens).items():
+                    self.buffered_postings[term].append((doc, tf))
+                    self.buffered_count += 1
+                docs.append((doc, str(row["row_id"]), len(tokens), row["body_blob"], json.dumps(row.get("metadata") or {})))
+                self.buffered_docs += 1
+                self.buffered_length += len(tokens)
+            # written in the open transaction, committed with their postings
+            self.db.executemany("INSERT OR REPLACE INTO docs (doc, row_id, length, body, metadata, live) VALUES (?, ?, ?, ?, ?, 1)", docs)
+            if self.buffered_count >= self.max_buffered:
+                self.flush()
+
+    def flush(self) -> None:
+        """Merge the buffered postings into the term blobs, one read and write per term, and commit."""
+        with self.lock:
+            for term, postings in self.buffered_postings.items():
+                row = self.db.execute("SELECT postings FROM terms WHERE term = ?", (term,)).fetchone()
+                merged = (decode_postings(row[0]) if row else []) + postings
+                self.db.execute("INSERT OR REPLACE INTO terms (term, postings) VALUES (?, ?)", (term, encode_postings(merged)))
+            self.db.commit()
+            self.live_docs += self.buffered_docs
+            self.total_length += self.buffered_length
+            self.reset_buffer()
+
+    def discard(self) -> None:
+        """Forget the chunks added since the last flush."""
+        with self.lock:
+            self.db.rollback()
+            self.reset_buffer()
+            self.next_doc = self.db.execute("SELECT COALESCE(MAX(doc) + 1, 0) FROM docs").fetchone()[0]
+
+    def remove(self, row_ids: set) -> None:
+        if not row_ids:
+            return
+        with self.lock:
+            for row_id in row_ids:
+                row = self.db.execute("SELECT doc, length FROM docs WHERE row_id = ? AND live = 1", (row_id,)).fetchone()
+                if row is None:
+                    continue
+                self.db.execute("UPDATE docs SET live = 0 WHERE doc = ?", (row[0],))
+                self.dead.add(row[0])
+                self.live_docs -= 1
+                self.dead_docs += 1
+                self.total_length -= row[1]
+            self.db.commit()
+            if self.dead_docs > 0.2 * max(self.live_docs, 1):
+                self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the postings without tombstoned chunks."""
+        with self.lock:
+            for term, blob in self.db.execute("SELECT term, postings FROM terms").fetchall():
+                postings = [(doc, tf) for doc, tf in decode_postings(blob) if doc not in self.dead]
+                if postings:
+                    self.db.execute("UPDATE terms SET postings = ? WHERE term = ?", (encode_postings(postings), term))
+                else:
+                    self.db.execute("DELETE FROM terms WHERE term = ?", (term,))
+            self.db.execute("DELETE FROM docs WHERE live = 0")
+            self.db.commit()
+            self.db.execute("VACUUM")
+            self.dead.clear()
+            self.dead_docs = 0
+
+    def search(self, query: str, k: int, row_ids: set = None) -> List[ScoredDocument]:
+        """
+        Returns:
+            list: (document, BM25 score) pairs, best first.
+        """
+        terms = set(tokenize(query))
+        with self.lock:
+            if not terms or not self.live_docs:
+                return []
+            avg_length = self.total_length / self.live_docs
+            scores = defaultdict(float)
+            postings_by_term = {}
+            for term in terms:
+                row = self.db.execute("SELECT postings FROM terms WHERE term = ?", (term,)).fetchone()
+                if row:
+                    postings_by_term[term] = [(doc, tf) for doc, tf in decode_postings(row[0]) if doc not in self.dead]
+            doc_ids = {doc for postings in postings_by_term.values() for doc, _ in postings}
+            if not doc_ids:
+                return []
+            lengths = {}
+            for start in range(0, len(doc_ids), 900):
+                chunk = list(doc_ids)[start:start + 900]
+                placeholders = ",".join("?" * len(chunk))
+                query_sql = f"SELECT doc, length, row_id FROM docs WHERE doc IN ({placeholders})"
+                for doc, length, row_id in self.db.execute(query_sql, chunk):
+                    if row_ids is None or row_id in row_ids:
+                        lengths[doc] = length
+            for postings in postings_by_term.values():
+                idf = math.log(1 + (self.live_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc, tf in postings:
+                    if doc in lengths:
+                        norm = self.k1 * (1 - self.b + self.b * lengths[doc] / avg_length)
+                        scores[doc] += idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            results = []
+            for doc, score in best:
+                row_id, body, metadata = self.db.execute("SELECT row_id, body, metadata FROM docs WHERE doc = ?", (doc,)).fetchone()
+                results.append((Document(page_content=body, metadata=json.loads(metadata), id=row_id), score))
+            return results
+
+class BM25Indexes:
+    """
+    One BM25 index per KB table, created the first time the table is searched.
+    A background thread indexes the chunks of new tables and then keeps every table in sync with
+    Astra each sync_interval seconds. A table returns None until its first sync completed, a failed
+    sync is retried on the next pass of the thread.
+    """
+    def __init__(self, directory: str = ".bm25_index", sync_interval: float = 600, enabled: bool = False):
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.enabled = enabled
+        self.indexes: Dict[str, BM25Index] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def get(self, table_name: str) -> BM25Index | None:
+        if not self.enabled or not re.fullmatch(r"[a-z0-9_]+", table_name):
+            return None
+        with self.lock:
+            index = self.indexes.get(table_name)
+            if index is None:
+                index = self.indexes[table_name] = BM25Index(table_name, self.directory)
+                self.wakeup.set()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="bm25-sync", daemon=True)
+                self.thread.start()
+        return index
+
+    def run(self) -> None:
+        while True:
+            with self.lock:
+                pending = [index for index in self.indexes.values()
+                           if index.synced_at is None or time.time() - index.synced_at > self.sync_interval]
+            for index in pending:
+                try:
+                    self.sync(index)
+                except Exception as e:
+                    # synced_at is left as is, the table is retried on the next pass
+                    logger.error(f"BM25 sync of {index.table_name} failed: {str(e)}")
+            self.wakeup.wait(timeout=min(self.sync_interval, 60))
+            self.wakeup.clear()
+
+    def sync(self, index: BM25Index) -> None:
+        start = time.time()
+        removed = set()
+        try:
+            for rows, removed in diff_remote_table(index.table_name, index.known_ids()):
+                index.add(rows)
+            index.flush()
+        except Exception:
+            index.discard()
+            raise
+        index.remove(removed)
+        index.synced_at = time.time()
+        logger.info(f"BM25 synced {index.table_name}: {index.live_docs} chunks in {time.time() - start:.2f}s")
+
+    def search(self, table_name: str, query: str, k: int, row_ids: set = None) -> List[ScoredDocument] | None:
+        """
+        Returns:
+            list | None: (document, BM25 score) pairs, None if the table has no index yet.
+        """
+        index = self.get(table_name)
+        if index is None or not index.ready:
+            return None
+        return index.search(query, k, row_ids)
+
+bm25_indexes = BM25Indexes(directory=config.BM25_INDEX_DIR, sync_interval=config.BM25_SYNC_INTERVAL,
+                           enabled=config.BM25_ENABLED)
@@ -7,7 +7,6 @@ from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, WebDriverException, ElementClickInterceptedException
 from selenium.webdriver.common.action_chains import ActionChains
 from typing import List, Tuple, Type, Dict
-from bs4 import BeautifulSoup
 from urllib.parse import urlparse
 from fake_useragent import UserAgent
 from selenium_stealth import stealth
@@ -21,14 +20,16 @@ import os
 import shutil
 import uuid
 import tempfile
-import markdownify
 import sys
 import re
+import hashlib
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utility import pretty_print, animate_thinking
 from logger import Logger
+from page_cache import page_cache
+from html_extract import extract_markdown
 
 
 def get_chrome_path() -> str:
@@ -360,30 +361,20 @@ class Browser:
         return (word_count >= 5 and (has_punctuation or is_long_enough))
 
     def get_text(self) -> str | None:
-        """Get page text as formatted Markdown"""
+        """Get page text as formatted Markdown, the page cache skips the conversion when the page source is unchanged"""
         try:
-            soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-            for element in soup(['script', 'style', 'noscript', 'meta', 'link']):
-                element.decompose()
-            markdown_converter = markdownify.MarkdownConverter(
-                heading_style="ATX",
-                strip=['a'],
-                autolinks=False,
-                bullets='•',
-                strong_em_symbol='*',
-                default_title=False,
-            )
-            markdown_text = markdown_converter.convert(str(soup.body))
-            lines = []
-            for line in markdown_text.splitlines():
-                stripped = line.strip()
-                if stripped and self.is_sentence(stripped):
-                    cleaned = ' '.join(stripped.split())
-                    lines.append(cleaned)
+            url = self.driver.current_url
+            page_source = self.driver.page_source
+            digest = hashlib.sha1(page_source.encode("utf-8")).hexdigest()
+            cached = page_cache.get(url, "browser")
+            if cached and cached.etag == digest:
+                self.logger.info(f"Page text of {url} served from the page cache")
+                return cached.text
+            lines = extract_markdown(page_source, keep=self.is_sentence, max_chars=32768)
             result = "[Start of page]\n\n" + "\n\n".join(lines) + "\n\n[End of page]"
-            result = re.sub(r'!\[(.*?)\]\(.*?\)', r'[IMAGE: \1]', result)
             self.logger.info(f"Extracted text: {result[:100]}...")
             self.logger.info(f"Extracted text length: {len(result)}")
+            page_cache.put(url, "browser", result[:32768], etag=digest)
             return result[:32768]
         except Exception as e:
             self.logger.error(f"Error getting text: {str(e)}")
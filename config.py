@@ -64,6 +64,80 @@ AWS_SECRET_ACCESS_KEY = get_env_var('AWS_SECRET_ACCESS_KEY', required=True)
 # Brave Search API
 BRAVE_API_KEY = get_env_var('BRAVE_API_KEY', required=True)
 POSTGRES_URL = get_env_var('POSTGRES_URL', required=True)
+# Connection pooling: 'queue' keeps POSTGRES_POOL_SIZE connections open per process, 'null' opens one per session
+POSTGRES_POOL = get_env_var('POSTGRES_POOL', 'queue')
+POSTGRES_POOL_SIZE = int(get_env_var('POSTGRES_POOL_SIZE', '5'))
+POSTGRES_MAX_OVERFLOW = int(get_env_var('POSTGRES_MAX_OVERFLOW', '10'))
+
+# Token usage accounting: seconds between two batched writes to token_metrics
+TOKEN_METRICS_FLUSH_INTERVAL = float(get_env_var('TOKEN_METRICS_FLUSH_INTERVAL', '30'))
+
+# Knowledge base retrieval: parallel vector searches per request and query embedding cache
+KB_SEARCH_CONCURRENCY = int(get_env_var('KB_SEARCH_CONCURRENCY', '8'))
+QUERY_EMBEDDING_CACHE_SIZE = int(get_env_var('QUERY_EMBEDDING_CACHE_SIZE', '2048'))
+QUERY_EMBEDDING_CACHE_TTL = float(get_env_var('QUERY_EMBEDDING_CACHE_TTL', '3600'))
+VECTOR_STORE_IDLE_TTL = float(get_env_var('VECTOR_STORE_IDLE_TTL', '1800'))
+KB_TOP_K = int(get_env_var('KB_TOP_K', '10'))
+KB_CONTEXT_TOKENS = int(get_env_var('KB_CONTEXT_TOKENS', '3000'))
+KB_DEDUP_THRESHOLD = float(get_env_var('KB_DEDUP_THRESHOLD', '0.85'))
+# Row id restriction: up to KB_FILTER_DIRECT_LIMIT rows per table are fetched by key, above it the search oversamples,
+# widening up to KB_FILTER_MAX_FETCH rows until top_k rows pass the filter
+KB_FILTER_DIRECT_LIMIT = int(get_env_var('KB_FILTER_DIRECT_LIMIT', '64'))
+KB_FILTER_OVERSAMPLE = int(get_env_var('KB_FILTER_OVERSAMPLE', '4'))
+KB_FILTER_MAX_FETCH = int(get_env_var('KB_FILTER_MAX_FETCH', '1000'))
+# Seconds a bot retrieval plan (prompt, web search flag, knowledge bases, row ids) is served from memory,
+# and seconds between two reads of the invalidations made through the other API workers
+RETRIEVAL_PLAN_TTL = float(get_env_var('RETRIEVAL_PLAN_TTL', '300'))
+RETRIEVAL_PLAN_SYNC_INTERVAL = float(get_env_var('RETRIEVAL_PLAN_SYNC_INTERVAL', '2'))
+# Token expected in the X-Admin-Token header of the cache invalidation routes, empty disables the routes
+ADMIN_API_TOKEN = get_env_var('ADMIN_API_TOKEN', '')
+# Local mirror of hot vector tables, comma separated table names, empty to always query Astra
+LOCAL_INDEX_TABLES = get_env_var('LOCAL_INDEX_TABLES', '')
+LOCAL_INDEX_DIR = get_env_var('LOCAL_INDEX_DIR', '.local_index')
+LOCAL_INDEX_SYNC_INTERVAL = float(get_env_var('LOCAL_INDEX_SYNC_INTERVAL', '300'))
+LOCAL_INDEX_NLIST = int(get_env_var('LOCAL_INDEX_NLIST', '256'))
+LOCAL_INDEX_NPROBE = int(get_env_var('LOCAL_INDEX_NPROBE', '16'))
+# Hybrid retrieval: BM25 index per KB table fused with the vector results by reciprocal rank
+BM25_ENABLED = get_env_var('BM25_ENABLED', 'false').lower() == 'true'
+BM25_INDEX_DIR = get_env_var('BM25_INDEX_DIR', '.bm25_index')
+BM25_SYNC_INTERVAL = float(get_env_var('BM25_SYNC_INTERVAL', '600'))
+# Per bot semantic answer cache: min cosine similarity of questions, TTL in seconds (short TTL for web search bots)
+ANSWER_CACHE_THRESHOLD = float(get_env_var('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_TTL = float(get_env_var('ANSWER_CACHE_TTL', '86400'))
+ANSWER_CACHE_WEB_TTL = float(get_env_var('ANSWER_CACHE_WEB_TTL', '600'))
+# Deadlines (seconds) of the web search and knowledge base branches of a retrieval request
+WEB_SEARCH_TIMEOUT = float(get_env_var('WEB_SEARCH_TIMEOUT', '20'))
+KB_RETRIEVAL_TIMEOUT = float(get_env_var('KB_RETRIEVAL_TIMEOUT', '15'))
+# Web search page fetching: pages fetched at once, at once per domain, and deadline (seconds) of the whole fetch stage
+WEB_FETCH_CONCURRENCY = int(get_env_var('WEB_FETCH_CONCURRENCY', '6'))
+WEB_FETCH_PER_DOMAIN = int(get_env_var('WEB_FETCH_PER_DOMAIN', '2'))
+WEB_FETCH_DEADLINE = float(get_env_var('WEB_FETCH_DEADLINE', '12'))
+# Shared HTTP client of the web tools: timeouts (seconds), pool size and retries of idempotent requests
+HTTP_TIMEOUT = float(get_env_var('HTTP_TIMEOUT', '15'))
+HTTP_CONNECT_TIMEOUT = float(get_env_var('HTTP_CONNECT_TIMEOUT', '5'))
+HTTP_MAX_CONNECTIONS = int(get_env_var('HTTP_MAX_CONNECTIONS', '100'))
+HTTP_MAX_KEEPALIVE = int(get_env_var('HTTP_MAX_KEEPALIVE', '20'))
+HTTP_RETRIES = int(get_env_var('HTTP_RETRIES', '3'))
+# On-disk cache of extracted page text, revalidated with ETag/Last-Modified after its TTL (seconds)
+PAGE_CACHE_ENABLED = get_env_var('PAGE_CACHE_ENABLED', 'true').lower() == 'true'
+PAGE_CACHE_PATH = get_env_var('PAGE_CACHE_PATH', '.page_cache/pages.db')
+PAGE_CACHE_MAX_MB = float(get_env_var('PAGE_CACHE_MAX_MB', '256'))
+PAGE_CACHE_TTL = float(get_env_var('PAGE_CACHE_TTL', '3600'))
+# Per domain TTLs, subdomains included. eg: wikipedia.org=86400,reuters.com=300
+PAGE_CACHE_DOMAIN_TTLS = get_env_var('PAGE_CACHE_DOMAIN_TTLS', 'wikipedia.org=86400,docs.python.org=86400,github.com=21600')
+# Web search context: token budget of the passages sent to the model, tokens kept per fetched page,
+# words per passage and max passages taken from one page
+WEB_CONTEXT_TOKENS = int(get_env_var('WEB_CONTEXT_TOKENS', '6000'))
+WEB_PAGE_MAX_TOKENS = int(get_env_var('WEB_PAGE_MAX_TOKENS', '20000'))
+WEB_PASSAGE_WORDS = int(get_env_var('WEB_PASSAGE_WORDS', '120'))
+WEB_PASSAGES_PER_PAGE = int(get_env_var('WEB_PASSAGES_PER_PAGE', '4'))
+# Web search caches (seconds): question to LLM rewritten query (at most until midnight), query to Brave results,
+# rewrites and results of time sensitive questions
+SEARCH_REWRITE_TTL = float(get_env_var('SEARCH_REWRITE_TTL', '21600'))
+SEARCH_RESULTS_TTL = float(get_env_var('SEARCH_RESULTS_TTL', '1800'))
+SEARCH_FRESH_TTL = float(get_env_var('SEARCH_FRESH_TTL', '300'))
+# Cross-encoder used to rerank the merged chunks, empty to disable. eg: cross-encoder/ms-marco-MiniLM-L-6-v2
+KB_RERANK_MODEL = get_env_var('KB_RERANK_MODEL', '')
 
 # Legacy token mappings for backward compatibility
 TOKENS = {
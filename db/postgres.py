@@ -1,18 +1,26 @@
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
 import logging
 import config
 
 log = logging.getLogger(__name__)
 
 DATABASE_URL = config.POSTGRES_URL
+if config.POSTGRES_POOL == "null":
+    pool_options = {"poolclass": NullPool}
+else:
+    pool_options = {
+        "poolclass": QueuePool,
+        "pool_size": config.POSTGRES_POOL_SIZE,
+        "max_overflow": config.POSTGRES_MAX_OVERFLOW,
+    }
 engine = create_engine(
     DATABASE_URL,
     pool_recycle=300,
     pool_pre_ping=True,
-    poolclass=NullPool
+    **pool_options
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
\ No newline at end of file
@@ -0,0 +1,187 @@
+from typing import Callable, Iterator, List
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+BACKEND = "selectolax" if LexborHTMLParser else "lxml" if lxml else "bs4"
+
+NOISE_TAGS = ["script", "style", "noscript", "iframe", "template", "svg", "canvas", "object", "embed", "meta", "link"]
+BOILERPLATE_TAGS = ["header", "footer", "nav", "aside"]
+BOILERPLATE_ROLES = {"navigation", "banner", "contentinfo"}
+BOILERPLATE_SELECTOR = '[role="navigation"], [role="banner"], [role="contentinfo"], [aria-hidden="true"], [hidden]'
+BOILERPLATE_XPATH = ('//*[@role="navigation" or @role="banner" or @role="contentinfo" '
+                     'or @aria-hidden="true" or @hidden]')
+BLOCK_TAGS = ["p", "div", "section", "article", "main", "header", "footer", "nav", "aside", "form", "ul", "ol", "li", "dl", "dt", "dd", "table", "tr",
+              "th", "td", "blockquote", "pre", "figure", "figcaption", "br", "hr",
+              "h1", "h2", "h3", "h4", "h5", "h6"]
+HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+# Block boundary marker, a private use character lxml accepts in text.
+# Newlines inside text nodes are collapsed like a browser does, only this marker splits lines.
+BREAK = "\ue000"
+
+def _selectolax_text(html: str, boilerplate: bool, markdown: bool) -> str:
+    tree = LexborHTMLParser(html)
+    tree.strip_tags(NOISE_TAGS + (BOILERPLATE_TAGS if boilerplate else []))
+    if boilerplate:
+        for node in tree.css(BOILERPLATE_SELECTOR):
+            node.decompose()
+    if markdown:
+        for node in tree.css("img"):
+            alt = (node.attributes.get("alt") or "").strip()
+            if alt:
+                node.replace_with(f" [IMAGE: {alt}] ")
+            else:
+                node.decompose()
+        for tag in HEADING_TAGS:
+            for node in tree.css(tag):
+                if node.first_child is not None:
+                    node.first_child.insert_before("#" * int(tag[1]) + " ")
+        for node in tree.css("li"):
+            if node.first_child is not None:
+                node.first_child.insert_before("• ")
+    for node in tree.css(", ".join(BLOCK_TAGS)):
+        node.insert_before(BREAK)
+        node.insert_after(BREAK)
+    root = tree.body or tree.root
+    return root.text(separator="") if root is not None else ""
+
+def _lxml_text(html: str, boilerplate: bool, markdown: bool) -> str:
+    try:
+        doc = lxml.html.document_fromstring(html)
+    except ValueError:
+        # Strings with an xml encoding declaration are only parsed as bytes
+        doc = lxml.html.document_fromstring(html.encode("utf-8"))
+    tags = NOISE_TAGS + (BOILERPLATE_TAGS if boilerplate else [])
+    for element in doc.xpath(" | ".join(f"//{tag}" for tag in tags)):
+        element.drop_tree()
+    if boilerplate:
+        for element in doc.xpath(BOILERPLATE_XPATH):
+            if element.getparent() is not None:
+                element.drop_tree()
+    # Comments and processing instructions carry no text
+    for element in doc.xpath("//comment() | //processing-instruction()"):
+        if element.getparent() is not None:
+            element.drop_tree()
+    if markdown:
+        for element in doc.xpath("//img"):
+            alt = (element.get("alt") or "").strip()
+            element.tail = (f" [IMAGE: {alt}] " if alt else "") + (element.tail or "")
+            element.drop_tree()
+        for element in doc.xpath(" | ".join(f"//{tag}" for tag in HEADING_TAGS)):
+            element.text = "#" * int(element.tag[1]) + " " + (element.text or "")
+        for element in doc.xpath("//li"):
+            element.text = "• " + (element.text or "")
+    for element in doc.xpath(" | ".join(f"//{tag}" for tag in BLOCK_TAGS)):
+        element.text = BREAK + (element.text or "")
+        element.tail = BREAK + (element.tail or "")
+    root = doc.body if doc.find("body") is not None else doc
+    return root.text_content()
+
+def _bs4_text(html: str, boilerplate: bool, markdown: bool) -> str:
+    from bs4 import BeautifulSoup, NavigableString
+    soup = BeautifulSoup(html, "html.parser")
+    dropped = set(NOISE_TAGS + (BOILERPLATE_TAGS if boilerplate else []))
+    blocks = set(BLOCK_TAGS)
+    # Iterative walk, html.parser nests unclosed tags deep enough to exceed the recursion limit
+    out = []
+    stack = [(iter((soup.body or soup).children), False)]
+    while stack:
+        children, is_block = stack[-1]
+        child = next(children, None)
+        if child is None:
+            stack.pop()
+            if is_block:
+                out.append(BREAK)
+            continue
+        if isinstance(child, NavigableString):
+            # Subclasses are comments, doctypes and the like
+            if type(child) is NavigableString:
+                out.append(child)
+            continue
+        if child.name in dropped:
+            continue
+        if boilerplate and (child.get("role") in BOILERPLATE_ROLES or child.get("aria-hidden") == "true"
+                            or child.has_attr("hidden")):
+            continue
+        if markdown and child.name == "img":
+            alt = (child.get("alt") or "").strip()
+            out.append(f" [IMAGE: {alt}] " if alt else "")
+            continue
+        block = child.name in blocks
+        if block:
+            out.append(BREAK)
+        if markdown and child.name in HEADING_TAGS:
+            out.append("#" * int(child.name[1]) + " ")
+        elif markdown and child.name == "li":
+            out.append("• ")
+        stack.append((iter(child.children), block))
+    return "".join(out)
+
+BACKENDS = {
+    "selectolax": _selectolax_text,
+    "lxml": _lxml_text,
+    "bs4": _bs4_text,
+}
+
+def block_text(html: str, boilerplate: bool = True, markdown: bool = False, backend: str = None) -> str:
+    """
+    Text of a page with a break marker around every block element.
+    Args:
+        html (str): The page.
+        boilerplate (bool): Drop headers, footers, navigation, sidebars and hidden elements.
+        markdown (bool): Prefix headings with # and list items with a bullet, images become [IMAGE: alt].
+        backend (str, optional): selectolax, lxml or bs4, the fastest installed parser if None.
+    """
+    if not html or not html.strip():
+        return ""
+    return BACKENDS[backend or BACKEND](html, boilerplate, markdown)
+
+def iter_lines(text: str, keep: Callable[[str], bool] = None) -> Iterator[str]:
+    """
+    Lines of a block_text output with whitespace collapsed, empty lines and lines rejected by keep skipped.
+    """
+    start = 0
+    while start <= len(text):
+        end = text.find(BREAK, start)
+        if end == -1:
+            end = len(text)
+        line = " ".join(text[start:end].split())
+        if line and (keep is None or keep(line)):
+            yield line
+        start = end + 1
+
+def take_lines(lines: Iterator[str], max_chars: int = None) -> List[str]:
+    """Consume lines until max_chars characters were taken, the rest of the page is never cleaned."""
+    taken, size = [], 0
+    for line in lines:
+        if max_chars is not None and size + len(line) > max_chars:
+            break
+        taken.append(line)
+        size += len(line) + 1
+    return taken
+
+def extract_text(html: str, boilerplate: bool = True, max_chars: int = None, backend: str = None) -> str:
+    """
+    Visible text of a page, one line per text block.
+    Returns:
+        str: The lines joined by newlines.
+    """
+    return "\n".join(take_lines(iter_lines(block_text(html, boilerplate, backend=backend)), max_chars))
+
+def extract_markdown(html: str, keep: Callable[[str], bool] = None, boilerplate: bool = False,
+                     max_chars: int = None, backend: str = None) -> List[str]:
+    """
+    Markdown-like lines of a page: headings, bullets and image placeholders, links reduced to their text.
+    Args:
+        keep (callable, optional): Line filter, eg: only sentences.
+    Returns:
+        list: The kept lines.
+    """
+    return take_lines(iter_lines(block_text(html, boilerplate, markdown=True, backend=backend), keep), max_chars)
@@ -0,0 +1,105 @@
+import random
+import threading
+import time
+
+import httpx
+
+import config
+from logger import Logger
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class HttpClient:
+    """
+    Process wide pooled HTTP client for outbound page fetches and search API calls.
+    One httpx.Client keeps connections, TLS sessions and HTTP/2 streams alive across requests and
+    threads. Idempotent requests are retried on connection errors and on the retryable status codes
+    with exponential backoff, the same policy the per-request requests sessions used.
+    """
+    RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+    def __init__(self, timeout: float = 15, connect_timeout: float = 5,
+                 max_connections: int = 100, max_keepalive: int = 20,
+                 retries: int = 3, backoff_factor: float = 1,
+                 status_forcelist: tuple = (429, 500, 502, 503, 504)):
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = set(status_forcelist)
+        self.lock = threading.Lock()
+        self._client = None
+        self.logger = Logger("http_client.log")
+
+    @property
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    self._client = httpx.Client(http2=HTTP2_AVAILABLE, timeout=self.timeout,
+                                                limits=self.limits, follow_redirects=True)
+                    self.logger.info(f"Created HTTP client (http2={HTTP2_AVAILABLE})")
+        return self._client
+
+    def backoff(self, attempt: int, response: httpx.Response = None) -> float:
+        """Seconds to wait before the next attempt, Retry-After of the response first."""
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), 30)
+        return self.backoff_factor * (2 ** attempt) * random.uniform(0.5, 1)
+
+    def request(self, method: str, url: str, timeout: float = None, retry: bool = True, **kwargs) -> httpx.Response:
+        """
+        Send a request through the shared pool.
+        Args:
+            method (str): HTTP method.
+            url (str): The url.
+            timeout (float, optional): Overall timeout of each attempt, the client default if None.
+            retry (bool): Retry idempotent requests on connection errors and retryable status codes.
+            **kwargs: Passed to httpx.Client.request (headers, params, data, json...).
+        Returns:
+            httpx.Response: The last response, the caller checks the status.
+        Raises:
+            httpx.HTTPError: When the last attempt failed without a response.
+        """
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect=min(timeout, self.timeout.connect))
+        attempts = self.retries + 1 if retry and method.upper() in self.RETRY_METHODS else 1
+        for attempt in range(attempts):
+            last = attempt == attempts - 1
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if last:
+                    raise
+                self.logger.warning(f"{method} {url} failed ({type(e).__name__}), retrying")
+                time.sleep(self.backoff(attempt))
+                continue
+            if response.status_code not in self.status_forcelist or last:
+                return response
+            self.logger.warning(f"{method} {url} returned {response.status_code}, retrying")
+            time.sleep(self.backoff(attempt, response))
+
+    def get(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("POST", url, **kwargs)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+http_client = HttpClient(
+    timeout=config.HTTP_TIMEOUT,
+    connect_timeout=config.HTTP_CONNECT_TIMEOUT,
+    max_connections=config.HTTP_MAX_CONNECTIONS,
+    max_keepalive=config.HTTP_MAX_KEEPALIVE,
+    retries=config.HTTP_RETRIES,
+)
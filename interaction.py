@@ -163,6 +163,8 @@ class Interaction:
         if agent is None:
             return False
         agent.set_org(org, uid)
+        agent.complexity = self.router.last_complexity
+        agent.bot_key = self.bot_key or ""
         if self.current_agent != agent and self.last_answer is not None:
             push_last_agent_memory = True
         tmp = self.last_answer
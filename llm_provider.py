@@ -3,21 +3,30 @@ import platform
 import socket
 import subprocess
 import time
+from typing import Tuple
 from urllib.parse import urlparse
 
 import httpx
 import requests
 from dotenv import load_dotenv
 from ollama import Client as OllamaClient
-from openai import OpenAI
 
 from logger import Logger
+from model_tier import ModelTierPolicy, ModelTier
+from provider_pool import ProviderPool, OpenAIEndpoint, Completion, DEFAULT_OPENAI_URL
+from singleflight import SingleFlight
+from token_usage import usage_recorder
 from utility import pretty_print, animate_thinking
 
+# Shared by every Provider of the process: a Provider is created per request,
+# identical concurrent requests must still meet on the same in-flight call.
+inflight_requests = SingleFlight()
+
 class Provider:
-    def __init__(self, provider_name, model, server_address="127.0.0.1:5000", is_local=False):
+    def __init__(self, provider_name, model, server_address="127.0.0.1:5000", is_local=False, pool: ProviderPool = None, small_model: str = None):
         self.provider_name = provider_name.lower()
         self.model = model
+        self.tier_policy = ModelTierPolicy(model, small_model)
         self.is_local = is_local
         self.server_ip = server_address
         self.server_address = server_address
@@ -36,10 +45,20 @@ class Provider:
             self.api_key = self.get_api_key(self.provider_name)
         elif self.provider_name != "ollama":
             pretty_print(f"Provider: {provider_name} initialized at {self.server_ip}", color="success")
+        self.pool = pool
+        if self.pool is None and self.provider_name == "openai":
+            self.pool = ProviderPool([OpenAIEndpoint(DEFAULT_OPENAI_URL, api_key=self.api_key)])
 
     def get_model_name(self) -> str:
         return self.model
 
+    def select_model(self, purpose: str = None, complexity: str = None, large_model: str = None) -> Tuple[ModelTier, str]:
+        """
+        Select the model tier for a call, see ModelTierPolicy.
+        large_model is the model configured on the bot, if any.
+        """
+        return self.tier_policy.select(purpose, complexity, large_model)
+
     def get_api_key(self, provider):
         load_dotenv()
         api_key_var = f"{provider.upper()}_API_KEY"
@@ -56,14 +75,34 @@ class Provider:
             return "http://localhost", False
         return url, True
 
-    def respond(self, history, verbose=True):
+    def respond(self, history, verbose=True, model=None, usage=None):
         """
         Use the choosen provider to generate text.
+        Args:
+            history: The chat messages.
+            verbose: Print the answer.
+            model: Model to use instead of the default one (see select_model).
+            usage: (organization, usage_type, bot_key) the tokens of the call are accounted to.
         """
         llm = self.available_providers[self.provider_name]
-        self.logger.info(f"Using provider: {self.provider_name} at {self.server_ip}")
+        model = model or self.model
+        self.logger.info(f"Using provider: {self.provider_name} at {self.server_ip} with {model}")
+        key = SingleFlight.make_key(f"{self.provider_name}:{model}", history)
+
+        led = False
+        def generate() -> str:
+            nonlocal led
+            led = True
+            completion = llm(history, verbose, model)
+            # only the call that reached upstream is billed, coalesced callers spent nothing
+            if usage is not None:
+                self.logger.info(f"Usage {usage}: {completion.prompt_tokens} prompt + {completion.completion_tokens} completion tokens")
+                usage_recorder.record(*usage, chat_tokens=completion.prompt_tokens + completion.completion_tokens)
+            return completion.text
         try:
-            thought = llm(history, verbose)
+            thought = inflight_requests.do(key, generate)
+            if usage is not None and not led:
+                usage_recorder.record_coalesced(*usage)
         except KeyboardInterrupt:
             self.logger.warning("User interrupted the operation with Ctrl+C")
             return "Operation interrupted by user. REQUEST_EXIT"
@@ -106,33 +145,26 @@ class Provider:
         except (subprocess.TimeoutExpired, subprocess.SubprocessError) as e:
             return False
 
-    def openai_fn(self, history, verbose=False):
+    def openai_fn(self, history, verbose=False, model=None):
         """
-        Use openai to generate text.
+        Use the pool of openai compatible endpoints to generate text.
         """
-        client = OpenAI(api_key=self.api_key,  base_url=f"https://api.deepinfra.com/v1/openai")
         try:
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=history
-            )
-            if response is None:
-                raise Exception("OpenAI response is empty.")
-            thought = response.choices[0].message.content
+            completion = self.pool.complete(model or self.model, history)
             if verbose:
-                print(thought)
-            return thought
+                print(completion.text)
+            return completion
         except Exception as e:
             raise Exception(f"OpenAI API error: {str(e)}") from e
 
-    def test_fn(self, history, verbose=True):
+    def test_fn(self, history, verbose=True, model=None):
         """
         This function is used to conduct tests.
         """
         thought = """
 \n\n```json\n{\n  \"plan\": [\n    {\n      \"agent\": \"Web\",\n      \"id\": \"1\",\n      \"need\": null,\n      \"task\": \"Conduct a comprehensive web search to identify at least five AI startups located in Osaka. Use reliable sources and websites such as Crunchbase, TechCrunch, or local Japanese business directories. Capture the company names, their websites, areas of expertise, and any other relevant details.\"\n    },\n    {\n      \"agent\": \"Web\",\n      \"id\": \"2\",\n      \"need\": null,\n      \"task\": \"Perform a similar search to find at least five AI startups in Tokyo. Again, use trusted sources like Crunchbase, TechCrunch, or Japanese business news websites. Gather the same details as for Osaka: company names, websites, areas of focus, and additional information.\"\n    },\n    {\n      \"agent\": \"File\",\n      \"id\": \"3\",\n      \"need\": [\"1\", \"2\"],\n      \"task\": \"Create a new text file named research_japan.txt in the user's home directory. Organize the data collected from both searches into this file, ensuring it is well-structured and formatted for readability. Include headers for Osaka and Tokyo sections, followed by the details of each startup found.\"\n    }\n  ]\n}\n```
         """
-        return thought
+        return Completion(thought)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,26 @@
 #!/usr/bin python3
 
 import argparse
+import json
 import time
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 
 from sources.llamacpp_handler import LlamacppLLM
+from sources.llamacpp_batch_handler import LlamacppBatchLLM, supports_batching
 from sources.ollama_handler import OllamaLLM
 
 parser = argparse.ArgumentParser(description='asklly server script')
 parser.add_argument('--provider', type=str, help='LLM backend library to use. set to [ollama], [vllm] or [llamacpp]', required=True)
 parser.add_argument('--port', type=int, help='port to use', required=True)
+parser.add_argument('--slots', type=int, default=4, help='number of generations running in parallel, max sequences per batch with --scheduler batch')
+parser.add_argument('--scheduler', type=str, default='slots', choices=['slots', 'batch'], help='[slots] one worker thread per generation or [batch] continuous batching of all generations in shared decoding steps')
+parser.add_argument('--queue-size', type=int, default=32, help='number of generations allowed to wait for a free slot')
+parser.add_argument('--cache-size', type=int, default=10000, help='max number of cached responses, 0 disables the cache')
+parser.add_argument('--model', type=str, default=None, help='default model of the requests that do not name one, can still be changed with /setup')
+parser.add_argument('--n-ctx', type=int, default=8192, help='[llamacpp] context size')
+parser.add_argument('--kv-cache-mb', type=int, default=2048, help='[llamacpp] RAM budget of the prompt prefix KV cache, 0 disables it')
+parser.add_argument('--prompt-dir', type=str, default=None, help='[llamacpp] directory of system prompts to pre-evaluate, eg: ../prompts/base')
+parser.add_argument('--max-new-tokens', type=int, default=1024, help='[llamacpp batch] generation limit, reserved in the KV cache when a request is admitted')
 args = parser.parse_args()
 
 app = Flask(__name__)
@@ -17,11 +28,24 @@ app = Flask(__name__)
 assert args.provider in ["ollama", "llamacpp"], f"Provider {args.provider} does not exists. see --help for more information"
 
 handler_map = {
-    "ollama": OllamaLLM(),
-    "llamacpp": LlamacppLLM(),
+    "ollama": OllamaLLM,
+    "llamacpp": LlamacppLLM,
 }
 
-generator = handler_map[args.provider]
+generator_options = {"slots": args.slots, "queue_size": args.queue_size, "cache_size": args.cache_size}
+handler = handler_map[args.provider]
+if args.scheduler == "batch" and args.provider == "ollama":
+    print("Ollama batches concurrent requests itself, set OLLAMA_NUM_PARALLEL to --slots. Using the slots scheduler.")
+elif args.scheduler == "batch" and not supports_batching():
+    print("This llama_cpp version lacks the batch API. Using the slots scheduler.")
+elif args.scheduler == "batch":
+    handler = LlamacppBatchLLM
+    generator_options.update(n_ctx=args.n_ctx, max_new_tokens=args.max_new_tokens)
+if handler is LlamacppLLM:
+    generator_options.update(n_ctx=args.n_ctx, kv_cache_bytes=args.kv_cache_mb << 20, prompt_dir=args.prompt_dir)
+generator = handler(**generator_options)
+if args.model is not None:
+    generator.set_model(args.model)
 
 @app.route('/generate', methods=['POST'])
 def start_generation():
@@ -29,9 +53,13 @@ def start_generation():
         return jsonify({"error": "Generator not initialized"}), 401
     data = request.get_json()
     history = data.get('messages', [])
-    if generator.start(history):
-        return jsonify({"message": "Generation started"}), 202
-    return jsonify({"error": "Generation already in progress"}), 402
+    model = data.get('model') or generator.model
+    if model is None:
+        return jsonify({"error": "Model not provided and no default model set"}), 403
+    generation_id = generator.start(history, model)
+    if generation_id is None:
+        return jsonify({"error": "Generation queue is full"}), 429
+    return jsonify({"message": "Generation started", "id": generation_id}), 202
 
 @app.route('/setup', methods=['POST'])
 def setup():
@@ -46,8 +74,35 @@ def setup():
 def get_updated_sentence():
     if not generator:
         return jsonify({"error": "Generator not initialized"}), 405
-    print(generator.get_status())
-    return generator.get_status()
+    status = generator.get_status(request.args.get('id'))
+    if status is None:
+        return jsonify({"error": "Unknown generation id"}), 404
+    return status
+
+@app.route('/stream')
+def stream():
+    """
+    Server-sent events of a generation: a token event per generated chunk, then a done event.
+    The polling route /get_updated_sentence stays available.
+    """
+    state = generator.get_generation(request.args.get('id'))
+    if state is None:
+        return jsonify({"error": "Unknown generation id"}), 404
+
+    def events():
+        for chunk in state.iter_chunks():
+            if chunk is None:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: token\ndata: {json.dumps({'text': chunk})}\n\n"
+        yield f"event: done\ndata: {json.dumps({'id': state.id, 'error': state.error})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/status')
+def status():
+    return jsonify(generator.stats())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', threaded=True, debug=True, port=args.port)
\ No newline at end of file
@@ -1,36 +1,106 @@
-import os
+import hashlib
 import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 
 class Cache:
-    def __init__(self, cache_dir='.cache', cache_file='messages.json'):
+    """
+    Response cache of the generation server.
+    Entries are keyed by a hash of the model and the full message history and stored in SQLite,
+    so an insert writes a single row instead of rewriting the whole file.
+    The most recent entries are also kept in an in-memory LRU, the on-disk store is bounded
+    to max_entries by evicting the least recently used rows.
+    """
+    def __init__(self, cache_dir='.cache', cache_file='messages.db', max_entries: int = 10000, memory_entries: int = 256):
         self.cache_dir = Path(cache_dir)
         self.cache_file = self.cache_dir / cache_file
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        if not self.cache_file.exists():
-            with open(self.cache_file, 'w') as f:
-                json.dump([], f)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = sqlite3.connect(self.cache_file, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self.db.commit()
+        self.size = self.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
 
-        with open(self.cache_file, 'r') as f:
-            self.cache = set(json.load(f))
+    @staticmethod
+    def make_key(model: str, messages: list) -> str:
+        """Hash of the model and the role/content of every message."""
+        payload = json.dumps([model, [(msg.get('role'), msg.get('content')) for msg in messages]], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
 
-    def add_message_pair(self, user_message: str, assistant_message: str):
-        """Add a user/assistant pair to the cache if not present."""
-        if not any(entry["user"] == user_message for entry in self.cache):
-            self.cache.append({"user": user_message, "assistant": assistant_message})
-            self._save()
+    def get(self, model: str, messages: list) -> str | None:
+        """Return the cached response for this model and history, None on a miss."""
+        key = self.make_key(model, messages)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+            row = self.db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            self.hits += 1
+            self.remember(key, row[0])
+            return row[0]
 
-    def is_cached(self, user_message: str) -> bool:
-        """Check if a user msg is cached."""
-        return any(entry["user"] == user_message for entry in self.cache)
+    def put(self, model: str, messages: list, response: str) -> None:
+        """Store a response, evicting the least recently used rows above max_entries."""
+        key = self.make_key(model, messages)
+        now = time.time()
+        with self.lock:
+            inserted = self.db.execute(
+                "INSERT OR IGNORE INTO responses (key, model, response, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now)
+            ).rowcount
+            self.size += inserted
+            if self.size > self.max_entries:
+                excess = self.size - self.max_entries
+                self.db.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                    (excess,)
+                )
+                self.size -= excess
+                self.evictions += excess
+            self.db.commit()
+            self.remember(key, response)
 
-    def get_cached_response(self, user_message: str) -> str | None:
-        """Return the assistant response to a user message if cached."""
-        for entry in self.cache:
-            if entry["user"] == user_message:
-                return entry["assistant"]
-        return None
+    def remember(self, key: str, response: str) -> None:
+        """Add to the in-memory LRU. Caller holds the lock."""
+        self.memory[key] = response
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
 
-    def _save(self):
-        with open(self.cache_file, 'w') as f:
-            json.dump(self.cache, f, indent=2)
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self.size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -1,28 +1,137 @@
-
 import threading
 import logging
+import queue
+import time
+import uuid
 from abc import abstractmethod
+from collections import deque
 from .cache import Cache
 
+class ThroughputMeter:
+    """
+    Count generated tokens in one second buckets to report tokens/sec over a sliding window.
+    """
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self.lock = threading.Lock()
+        self.buckets = deque()
+        self.total = 0
+
+    def add(self, tokens: int = 1) -> None:
+        now = int(time.time())
+        with self.lock:
+            if self.buckets and self.buckets[-1][0] == now:
+                self.buckets[-1][1] += tokens
+            else:
+                self.buckets.append([now, tokens])
+            self.total += tokens
+            self.trim(now)
+
+    def trim(self, now: int) -> None:
+        """Drop buckets older than the window. Caller holds the lock."""
+        while self.buckets and now - self.buckets[0][0] >= self.window:
+            self.buckets.popleft()
+
+    def rate(self) -> float:
+        with self.lock:
+            self.trim(int(time.time()))
+            return sum(count for _, count in self.buckets) / self.window
+
 class GenerationState:
-    def __init__(self):
+    def __init__(self, generation_id: str, history: list, model: str, meter: ThroughputMeter = None):
+        self.id = generation_id
+        self.history = history
+        self.model = model
+        self.meter = meter
         self.lock = threading.Lock()
+        self.updated = threading.Condition(self.lock)
+        self.chunks = []
         self.last_complete_sentence = ""
         self.current_buffer = ""
         self.is_generating = False
-    
+        self.is_queued = True
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def begin(self) -> None:
+        with self.lock:
+            self.is_queued = False
+            self.is_generating = True
+
+    def append(self, text: str) -> None:
+        if not text:
+            return
+        if self.meter:
+            self.meter.add(1)
+        with self.updated:
+            self.chunks.append(text)
+            self.updated.notify_all()
+            self.current_buffer += text
+            end = max(self.current_buffer.rfind(p) for p in ['.', '!', '?', '\n'])
+            if end != -1:
+                self.last_complete_sentence = self.current_buffer[:end+1]
+
+    def finish(self, error: str = None) -> None:
+        with self.updated:
+            self.error = error
+            self.is_queued = False
+            self.is_generating = False
+            self.finished_at = time.time()
+            self.updated.notify_all()
+
+    def iter_chunks(self, keepalive: float = 15.0):
+        """
+        Yield the generated chunks as they arrive, from the first one, until the generation is complete.
+        Yield None when nothing arrived for keepalive seconds.
+        """
+        idx = 0
+        while True:
+            with self.updated:
+                if idx >= len(self.chunks) and not self.is_complete:
+                    self.updated.wait(timeout=keepalive)
+                new_chunks = self.chunks[idx:]
+                idx += len(new_chunks)
+                done = self.is_complete and idx >= len(self.chunks)
+            if not new_chunks and not done:
+                yield None
+            for chunk in new_chunks:
+                yield chunk
+            if done:
+                return
+
+    @property
+    def is_complete(self) -> bool:
+        return self.finished_at is not None
+
     def status(self) -> dict:
-        return {
-            "sentence": self.current_buffer,
-            "is_complete": not self.is_generating,
-            "last_complete_sentence": self.last_complete_sentence,
-            "is_generating": self.is_generating,
-        }
+        with self.lock:
+            return {
+                "id": self.id,
+                "sentence": self.current_buffer,
+                "is_complete": self.is_complete,
+                "last_complete_sentence": self.last_complete_sentence,
+                "is_generating": self.is_generating,
+                "is_queued": self.is_queued,
+                "error": self.error,
+            }
 
 class GeneratorLLM():
-    def __init__(self):
+    """
+    Serve many generations at once.
+    Each request gets its own GenerationState and id, requests wait in a bounded queue
+    and `slots` worker threads run them in parallel.
+    """
+    def __init__(self, slots: int = 1, queue_size: int = 16, retention: float = 600, cache_size: int = 10000):
         self.model = None
-        self.state = GenerationState()
+        self.cache = Cache(max_entries=cache_size) if cache_size > 0 else None
+        self.slots = slots
+        self.retention = retention
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.meter = ThroughputMeter()
+        self.generations = {}
+        self.generations_lock = threading.Lock()
+        self.last_generation_id = None
         self.logger = logging.getLogger(__name__)
         handler = logging.StreamHandler()
         handler.setLevel(logging.INFO)
@@ -30,33 +139,109 @@ class GeneratorLLM():
         handler.setFormatter(formatter)
         self.logger.addHandler(handler)
         self.logger.setLevel(logging.INFO)
-        cache = Cache()
-    
+        for i in range(slots):
+            threading.Thread(target=self.worker, name=f"generation-slot-{i}", daemon=True).start()
+
     def set_model(self, model: str) -> None:
         self.logger.info(f"Model set to {model}")
         self.model = model
-    
-    def start(self, history: list) -> bool:
-        if self.model is None:
+
+    def start(self, history: list, model: str = None) -> str | None:
+        """
+        Queue a generation.
+        Args:
+            history: the chat messages.
+            model: model of this generation, the one given to set_model if None.
+        Returns:
+            str | None: The generation id, None if the queue is full.
+        """
+        model = model or self.model
+        if model is None:
             raise Exception("Model not set")
-        with self.state.lock:
-            if self.state.is_generating:
-                return False
-            self.state.is_generating = True
-            self.logger.info("Starting generation")
-            threading.Thread(target=self.generate, args=(history,)).start()
-        return True
-    
-    def get_status(self) -> dict:
-        with self.state.lock:
-            return self.state.status()
+        state = GenerationState(uuid.uuid4().hex, history, model)
+        cached = self.cache.get(state.model, history) if self.cache else None
+        with self.generations_lock:
+            self.purge()
+            if cached is not None:
+                state.append(cached)
+                state.finish()
+                self.generations[state.id] = state
+                self.last_generation_id = state.id
+                self.logger.info(f"Generation {state.id} served from cache")
+                return state.id
+            state.meter = self.meter
+            try:
+                self.queue.put_nowait(state)
+            except queue.Full:
+                return None
+            self.generations[state.id] = state
+            self.last_generation_id = state.id
+        self.logger.info(f"Queued generation {state.id} ({self.queue.qsize()} waiting)")
+        return state.id
+
+    def worker(self) -> None:
+        while True:
+            state = self.queue.get()
+            state.begin()
+            self.logger.info(f"Starting generation {state.id}")
+            try:
+                self.generate(state)
+                if self.cache and state.current_buffer:
+                    self.cache.put(state.model, state.history, state.current_buffer)
+                state.finish()
+            except Exception as e:
+                self.logger.error(f"Generation {state.id} failed: {e}")
+                state.finish(error=str(e))
+            finally:
+                self.queue.task_done()
+
+    def purge(self) -> None:
+        """Forget generations finished for longer than the retention time. Caller holds generations_lock."""
+        now = time.time()
+        expired = [gid for gid, state in self.generations.items()
+                   if state.is_complete and now - state.finished_at > self.retention]
+        for gid in expired:
+            del self.generations[gid]
+
+    def get_generation(self, generation_id: str = None) -> GenerationState | None:
+        """
+        A generation by id, the last started one if no id is given.
+        """
+        with self.generations_lock:
+            return self.generations.get(generation_id or self.last_generation_id)
+
+    def get_status(self, generation_id: str = None) -> dict | None:
+        state = self.get_generation(generation_id)
+        if state is None:
+            return None
+        return state.status()
+
+    def stats(self) -> dict:
+        """
+        Server load, chunks are counted as tokens since backends stream about one token per chunk.
+        """
+        with self.generations_lock:
+            states = list(self.generations.values())
+        active = sum(1 for state in states if state.is_generating)
+        return {
+            "model": self.model,
+            "scheduler": "slots",
+            "slots": self.slots,
+            "queue_depth": self.queue.qsize(),
+            "active": active,
+            "batch_occupancy": active / self.slots if self.slots else 0.0,
+            "tokens_per_sec": self.meter.rate(),
+            "tokens_total": self.meter.total,
+            "tracked": len(states),
+            "cache": self.cache.stats() if self.cache else None,
+        }
 
     @abstractmethod
-    def generate(self, history: list) -> None:
+    def generate(self, state: GenerationState) -> None:
         """
         Generate text using the model.
         args:
-            history: list of strings
+            state: the GenerationState of the request, holds the history and receives the output.
         returns:
             None
         """
@@ -64,4 +249,4 @@ class GeneratorLLM():
 
 if __name__ == "__main__":
     generator = GeneratorLLM()
-    generator.get_status()
\ No newline at end of file
+    generator.get_status()
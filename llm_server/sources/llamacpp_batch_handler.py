@@ -0,0 +1,295 @@
+import codecs
+import queue
+import threading
+import numpy as np
+import llama_cpp
+from llama_cpp import Llama
+from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+from .generator import GeneratorLLM, GenerationState
+from .decorator import timer_decorator
+
+STOP_TOKENS = ["<|eot_id|>", "<|im_end|>", "<|end|>", "<end_of_turn>"]
+
+def supports_batching() -> bool:
+    """True if the installed llama_cpp exposes the low level batch API."""
+    return all(hasattr(llama_cpp, name) for name in ("llama_batch_init", "llama_decode", "llama_get_logits_ith"))
+
+def kv_seq_rm(ctx, seq_id: int) -> None:
+    """Drop every cached position of a sequence, the function moved across llama.cpp versions."""
+    if hasattr(llama_cpp, "llama_memory_seq_rm"):
+        llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, -1, -1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+        llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, -1, -1)
+    else:
+        llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, -1, -1)
+
+class Sequence:
+    """A generation admitted in the batch, bound to a KV sequence id."""
+    def __init__(self, state: GenerationState, seq_id: int, prompt_tokens: list, reserved: int):
+        self.state = state
+        self.seq_id = seq_id
+        self.pending = list(prompt_tokens)
+        self.n_past = 0
+        self.generated = 0
+        self.reserved = reserved
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+
+class LlamacppBatchLLM(GeneratorLLM):
+
+    def __init__(self, n_ctx: int = 8192, n_batch: int = 512, max_new_tokens: int = 1024,
+                 temperature: float = 0.7, top_k: int = 40, slots: int = 4, **kwargs):
+        """
+        Continuous batching on llama.cpp.
+        A single decode loop owns one context holding up to `slots` sequences. Every step evaluates
+        one token of each running sequence plus prompt chunks of newly admitted ones in a single
+        llama_decode call, so concurrent requests share forward passes instead of waiting on a lock.
+        A request is admitted when its prompt plus max_new_tokens fits in the free KV cells of the
+        n_ctx context, sequences leave the batch as soon as they end.
+        Args:
+            n_ctx: KV capacity in tokens, shared by all sequences.
+            n_batch: max tokens evaluated per step.
+            max_new_tokens: generation limit, reserved in the KV cache on admission.
+            temperature: sampling temperature, 0 for greedy decoding.
+            top_k: number of candidate tokens sampled from.
+            slots: max sequences decoded together.
+        """
+        super().__init__(slots=0, **kwargs)
+        self.slots = slots
+        self.n_ctx = n_ctx
+        self.n_batch = n_batch
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.rng = np.random.default_rng()
+        self.llm = None
+        self.ctx = None
+        self.batch = None
+        self.formatter = None
+        self.loaded_model = None
+        self.requested_model = None
+        self.idle_poll = 1.0
+        self.active = []
+        self.free_ids = list(range(slots))
+        self.kv_used = 0
+        self.head = None
+        self.head_tokens = None
+        self.steps = 0
+        self.batched_tokens = 0
+        threading.Thread(target=self.run, name="batch-decode", daemon=True).start()
+
+    def set_model(self, model: str) -> None:
+        """
+        Load the model before the first request.
+        Runs on the caller thread, the context belongs to the decode thread: the load is only requested
+        there and happens once the batch is empty.
+        """
+        super().set_model(model)
+        self.requested_model = model
+
+    def switch_model(self) -> None:
+        """Apply the model requested by set_model when no sequence is decoding and no request waits."""
+        if self.requested_model is None or self.active or self.head is not None:
+            return
+        model, self.requested_model = self.requested_model, None
+        self.load(model)
+
+    @timer_decorator
+    def load(self, model: str) -> None:
+        """Load weights and create the multi sequence context. Decode thread only, with no active sequence."""
+        if self.loaded_model == model:
+            return
+        self.logger.info(f"Loading {model} for batched decoding, n_ctx={self.n_ctx} sequences={self.slots}...")
+        self.release()
+        self.loaded_model = None
+        # The Llama object only serves tokenization here, keep its own context minimal.
+        self.llm = Llama.from_pretrained(
+            repo_id=model,
+            filename="*Q8_0.gguf",
+            n_ctx=512,
+            verbose=True
+        )
+        params = llama_cpp.llama_context_default_params()
+        params.n_ctx = self.n_ctx
+        params.n_batch = self.n_batch
+        params.n_seq_max = self.slots
+        if hasattr(params, "n_ubatch"):
+            params.n_ubatch = self.n_batch
+        if hasattr(params, "kv_unified"):
+            params.kv_unified = True
+        new_context = getattr(llama_cpp, "llama_init_from_model", None) or llama_cpp.llama_new_context_with_model
+        self.ctx = new_context(self.llm.model, params)
+        if self.ctx is None:
+            raise Exception("Failed to create the batched llama.cpp context")
+        self.batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        self.n_vocab = self.llm.n_vocab()
+        self.stop_ids = {self.llm.token_eos()}
+        for text in STOP_TOKENS:
+            ids = self.llm.tokenize(text.encode("utf-8"), add_bos=False, special=True)
+            if len(ids) == 1:
+                self.stop_ids.add(ids[0])
+        template = self.llm.metadata.get("tokenizer.chat_template")
+        self.formatter = Jinja2ChatFormatter(
+            template=template,
+            eos_token=self.token_text(self.llm.token_eos()),
+            bos_token=self.token_text(self.llm.token_bos())
+        ) if template else None
+        self.loaded_model = model
+
+    def release(self) -> None:
+        if self.batch is not None:
+            llama_cpp.llama_batch_free(self.batch)
+            self.batch = None
+        if self.ctx is not None:
+            llama_cpp.llama_free(self.ctx)
+            self.ctx = None
+
+    def token_text(self, token: int) -> str:
+        return self.llm.detokenize([token], special=True).decode("utf-8", errors="ignore")
+
+    def tokenize_prompt(self, history: list) -> list:
+        """Apply the model chat template and tokenize."""
+        messages = [{"role": msg.get("role"), "content": msg.get("content")} for msg in history]
+        if self.formatter is not None:
+            prompt = self.formatter(messages=messages).prompt
+            bos = self.token_text(self.llm.token_bos())
+            return self.llm.tokenize(prompt.encode("utf-8"), add_bos=not prompt.startswith(bos), special=True)
+        prompt = "".join(f"{msg['role']}: {msg['content']}\n" for msg in messages) + "assistant: "
+        return self.llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+
+    def run(self) -> None:
+        while True:
+            try:
+                self.switch_model()
+                self.admit()
+                if self.active:
+                    self.step()
+            except Exception as e:
+                self.logger.error(f"Batched decoding failed: {e}")
+                for seq in list(self.active):
+                    self.finish(seq, error=str(e))
+
+    def admit(self) -> None:
+        """
+        Move queued generations into the batch while a sequence id and enough KV cells are free.
+        Waits on the queue when nothing is running, up to idle_poll seconds so a requested model
+        switch is applied. The queue head waits in place when the KV cache is full, so requests are
+        admitted in arrival order. A head that cannot be loaded or tokenized is failed and dropped.
+        """
+        while len(self.active) < self.slots:
+            if self.head is None:
+                try:
+                    self.head = self.queue.get(block=not self.active, timeout=self.idle_poll)
+                except queue.Empty:
+                    return
+                self.head_tokens = None
+            state = self.head
+            try:
+                if state.model != self.loaded_model:
+                    if self.active:
+                        return
+                    self.load(state.model)
+                if self.head_tokens is None:
+                    self.head_tokens = self.tokenize_prompt(state.history)
+            except Exception as e:
+                self.logger.error(f"Generation {state.id} could not be admitted: {e}")
+                self.reject_head(str(e))
+                continue
+            prompt_len = len(self.head_tokens)
+            if prompt_len >= self.n_ctx:
+                self.reject_head(f"Prompt of {prompt_len} tokens exceeds the context size {self.n_ctx}")
+                continue
+            reserved = min(prompt_len + self.max_new_tokens, self.n_ctx)
+            if self.kv_used + reserved > self.n_ctx:
+                return
+            seq = Sequence(state, self.free_ids.pop(), self.head_tokens, reserved)
+            self.head = None
+            self.head_tokens = None
+            self.kv_used += reserved
+            self.active.append(seq)
+            state.begin()
+            self.logger.info(f"Admitted generation {state.id} ({prompt_len} prompt tokens, {len(self.active)} in batch)")
+
+    def reject_head(self, error: str) -> None:
+        """Fail the queue head without admitting it."""
+        state = self.head
+        self.head = None
+        self.head_tokens = None
+        state.finish(error=error)
+        self.queue.task_done()
+
+    def step(self) -> None:
+        """
+        Evaluate one llama_decode batch: the next token of every running sequence first,
+        then prompt tokens of prefilling sequences up to n_batch.
+        """
+        batch = self.batch
+        n_tokens = 0
+        logit_rows = []
+        for seq in sorted(self.active, key=lambda s: len(s.pending)):
+            take = seq.pending[:self.n_batch - n_tokens]
+            if not take:
+                break
+            for offset, token in enumerate(take):
+                batch.token[n_tokens] = token
+                batch.pos[n_tokens] = seq.n_past + offset
+                batch.n_seq_id[n_tokens] = 1
+                batch.seq_id[n_tokens][0] = seq.seq_id
+                batch.logits[n_tokens] = False
+                n_tokens += 1
+            seq.n_past += len(take)
+            del seq.pending[:len(take)]
+            if not seq.pending:
+                batch.logits[n_tokens - 1] = True
+                logit_rows.append((seq, n_tokens - 1))
+        batch.n_tokens = n_tokens
+        code = llama_cpp.llama_decode(self.ctx, batch)
+        if code != 0:
+            raise Exception(f"llama_decode returned {code}")
+        self.steps += 1
+        self.batched_tokens += n_tokens
+        for seq, row in logit_rows:
+            token = self.sample(row)
+            if token in self.stop_ids:
+                self.finish(seq)
+                continue
+            seq.generated += 1
+            seq.state.append(seq.decoder.decode(self.llm.detokenize([token])))
+            if seq.generated >= self.max_new_tokens or seq.n_past + 1 >= seq.reserved:
+                self.finish(seq)
+            else:
+                seq.pending = [token]
+
+    def sample(self, row: int) -> int:
+        logits = np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self.ctx, row), shape=(self.n_vocab,))
+        if self.temperature <= 0:
+            return int(np.argmax(logits))
+        candidates = np.argpartition(logits, -self.top_k)[-self.top_k:]
+        scaled = logits[candidates].astype(np.float64) / self.temperature
+        probs = np.exp(scaled - scaled.max())
+        return int(self.rng.choice(candidates, p=probs / probs.sum()))
+
+    def finish(self, seq: Sequence, error: str = None) -> None:
+        """Remove a sequence from the batch and give back its KV cells."""
+        self.active.remove(seq)
+        if self.ctx is not None:
+            kv_seq_rm(self.ctx, seq.seq_id)
+        self.free_ids.append(seq.seq_id)
+        self.kv_used -= seq.reserved
+        state = seq.state
+        if error is None and self.cache and state.current_buffer:
+            self.cache.put(state.model, state.history, state.current_buffer)
+        state.finish(error=error)
+        self.queue.task_done()
+        self.logger.info(f"Generation {state.id} left the batch after {seq.generated} tokens")
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["queue_depth"] += 1 if self.head is not None else 0
+        stats.update({
+            "scheduler": "batch",
+            "kv_used": self.kv_used,
+            "kv_capacity": self.n_ctx,
+            "decode_steps": self.steps,
+            "avg_tokens_per_step": self.batched_tokens / self.steps if self.steps else 0.0,
+        })
+        return stats
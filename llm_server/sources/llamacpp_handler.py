@@ -1,40 +1,76 @@
-
-from .generator import GeneratorLLM
-from llama_cpp import Llama
+import threading
+from pathlib import Path
+from .generator import GeneratorLLM, GenerationState
+from llama_cpp import Llama, LlamaRAMCache
 from .decorator import timer_decorator
 
 class LlamacppLLM(GeneratorLLM):
 
-    def __init__(self):
+    def __init__(self, n_ctx: int = 8192, kv_cache_bytes: int = 2 << 30, prompt_dir: str = None, **kwargs):
         """
         Handle generation using llama.cpp
+        A Llama instance holds a single context, generations on it are serialized by llm_lock.
+        Args:
+            n_ctx: context size of the model.
+            kv_cache_bytes: RAM budget of the prompt prefix KV cache, 0 disables it.
+            prompt_dir: directory of system prompts (*.txt) evaluated once at load time so agent
+                        requests sharing them only process the tokens after the system prompt.
         """
-        super().__init__()
+        super().__init__(**kwargs)
         self.llm = None
-    
+        self.llm_lock = threading.Lock()
+        self.n_ctx = n_ctx
+        self.kv_cache_bytes = kv_cache_bytes
+        self.prompt_dir = prompt_dir
+        self.loaded_model = None
+
+    def set_model(self, model: str) -> None:
+        """Load the model right away instead of on the first request."""
+        super().set_model(model)
+        with self.llm_lock:
+            self.load(model)
+
     @timer_decorator
-    def generate(self, history):
-        if self.llm is None:
-            self.logger.info(f"Loading {self.model}...")
-            self.llm = Llama.from_pretrained(
-                repo_id=self.model,
-                filename="*Q8_0.gguf",
-                n_ctx=4096,
-                verbose=True
+    def load(self, model: str) -> None:
+        """Load model and warm the prefix cache. Caller holds llm_lock."""
+        if self.loaded_model == model:
+            return
+        self.logger.info(f"Loading {model} with n_ctx={self.n_ctx}...")
+        self.llm = Llama.from_pretrained(
+            repo_id=model,
+            filename="*Q8_0.gguf",
+            n_ctx=self.n_ctx,
+            verbose=True
+        )
+        self.loaded_model = model
+        if self.kv_cache_bytes > 0:
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=self.kv_cache_bytes))
+            self.warm_prefix_cache()
+
+    def warm_prefix_cache(self) -> None:
+        """
+        Evaluate each system prompt once so its KV state is saved in the cache.
+        A later prompt starting with the same system message loads the longest matching
+        cached state and only evaluates the remaining tokens.
+        """
+        if self.prompt_dir is None:
+            return
+        for path in sorted(Path(self.prompt_dir).glob("*.txt")):
+            system_prompt = path.read_text(encoding="utf-8")
+            self.logger.info(f"Caching prompt prefix of {path.name}")
+            self.llm.create_chat_completion(
+                messages=[{"role": "system", "content": system_prompt}],
+                max_tokens=1
             )
-        self.logger.info(f"Using {self.model} for generation with Llama.cpp")
-        try:
-            with self.state.lock:
-                self.state.is_generating = True
-                self.state.last_complete_sentence = ""
-                self.state.current_buffer = ""
-            output = self.llm.create_chat_completion(
-                  messages = history
+
+    @timer_decorator
+    def generate(self, state: GenerationState):
+        with self.llm_lock:
+            self.load(state.model)
+            self.logger.info(f"Using {state.model} for generation {state.id} with Llama.cpp")
+            stream = self.llm.create_chat_completion(
+                  messages = state.history,
+                  stream = True
             )
-            with self.state.lock:
-                self.state.current_buffer = output['choices'][0]['message']['content']
-        except Exception as e:
-            self.logger.error(f"Error: {e}")
-        finally:
-            with self.state.lock:
-                self.state.is_generating = False
\ No newline at end of file
+            for chunk in stream:
+                state.append(chunk['choices'][0]['delta'].get('content'))
@@ -1,50 +1,35 @@
-
 import time
-from .generator import GeneratorLLM
-from .cache import Cache
+from .generator import GeneratorLLM, GenerationState
 import ollama
 
 class OllamaLLM(GeneratorLLM):
 
-    def __init__(self):
+    def __init__(self, **kwargs):
         """
         Handle generation using Ollama.
+        Parallel generations are served by the Ollama server itself (see OLLAMA_NUM_PARALLEL).
         """
-        super().__init__()
-        self.cache = Cache()
+        super().__init__(**kwargs)
 
-    def generate(self, history):
-        self.logger.info(f"Using {self.model} for generation with Ollama")
+    def generate(self, state: GenerationState):
+        self.logger.info(f"Using {state.model} for generation {state.id} with Ollama")
         try:
-            with self.state.lock:
-                self.state.is_generating = True
-                self.state.last_complete_sentence = ""
-                self.state.current_buffer = ""
-
             stream = ollama.chat(
-                model=self.model,
-                messages=history,
+                model=state.model,
+                messages=state.history,
                 stream=True,
             )
             for chunk in stream:
-                content = chunk['message']['content']
-
-                with self.state.lock:
-                    if '.' in content:
-                        self.logger.info(self.state.current_buffer)
-                    self.state.current_buffer += content
-
+                state.append(chunk['message']['content'])
         except Exception as e:
             if "404" in str(e):
-                self.logger.info(f"Downloading {self.model}...")
-                ollama.pull(self.model)
+                self.logger.info(f"Downloading {state.model}...")
+                ollama.pull(state.model)
             if "refused" in str(e).lower():
                 raise Exception("Ollama connection failed. is the server running ?") from e
             raise e
         finally:
-            self.logger.info("Generation complete")
-            with self.state.lock:
-                self.state.is_generating = False
+            self.logger.info(f"Generation {state.id} complete")
 
 if __name__ == "__main__":
     generator = OllamaLLM()
@@ -55,7 +40,7 @@ if __name__ == "__main__":
         }
     ]
     generator.set_model("deepseek-r1:1.5b")
-    generator.start(history)
+    generation_id = generator.start(history)
     while True:
-        print(generator.get_status())
-        time.sleep(1)
\ No newline at end of file
+        print(generator.get_status(generation_id))
+        time.sleep(1)
@@ -0,0 +1,337 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.documents import Document
+
+import config
+from logger import Logger
+from retrieval import ScoredDocument
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+logger = Logger("local_index.log")
+
+class IVFIndex:
+    """
+    Inverted file index: vectors are bucketed by their nearest k-means centroid and a search
+    only scores the nprobe buckets closest to the query.
+    """
+    def __init__(self, nlist: int = 256, nprobe: int = 16, iterations: int = 10):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.centroids = None
+        self.lists: List[List[int]] = []
+        self.trained_size = 0
+
+    def train(self, vectors: np.ndarray) -> None:
+        """Spherical k-means on a sample, then assign every vector."""
+        rng = np.random.default_rng(0)
+        nlist = min(self.nlist, len(vectors))
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assignment == c]
+                if len(members):
+                    mean = members.mean(axis=0)
+                    centroids[c] = mean / (np.linalg.norm(mean) + 1e-12)
+        self.centroids = centroids
+        self.lists = [[] for _ in range(nlist)]
+        self.add(vectors, np.arange(len(vectors)))
+        self.trained_size = len(vectors)
+
+    def add(self, vectors: np.ndarray, ids: np.ndarray) -> None:
+        for start in range(0, len(vectors), 65536):
+            assignment = np.argmax(vectors[start:start + 65536] @ self.centroids.T, axis=1)
+            for idx, c in zip(ids[start:start + 65536], assignment):
+                self.lists[c].append(int(idx))
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        probes = np.argsort(self.centroids @ query)[-self.nprobe:]
+        return np.fromiter((idx for c in probes for idx in self.lists[c]), dtype=np.int64)
+
+class LocalVectorIndex:
+    """
+    Local copy of one vector table.
+    Normalized vectors live in a memory mapped float32 file, row text and metadata in SQLite,
+    rows are addressed by their position in the vector file. Search uses HNSW when hnswlib is
+    installed, otherwise an IVF index once the table is large enough, brute force below that.
+    """
+    def __init__(self, table_name: str, directory: str, nlist: int = 256, nprobe: int = 16):
+        self.table_name = table_name
+        self.dir = Path(directory) / table_name
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.dir / "vectors.f32"
+        self.meta_path = self.dir / "index.json"
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.dir / "rows.db", check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS rows (
+                idx INTEGER PRIMARY KEY,
+                row_id TEXT UNIQUE NOT NULL,
+                body TEXT,
+                metadata TEXT,
+                live INTEGER NOT NULL DEFAULT 1
+            )
+        """)
+        self.db.commit()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dim = None
+        self.count = 0
+        self.capacity = 0
+        self.vectors = None
+        self.live = np.zeros(0, dtype=bool)
+        self.ann = None
+        self.ivf = None
+        self.synced_at = None
+        if self.meta_path.exists():
+            meta = json.loads(self.meta_path.read_text())
+            self.dim, self.count = meta["dim"], meta["count"]
+            self.open_vectors(max(self.count, 1))
+            self.live = np.zeros(self.capacity, dtype=bool)
+            for (idx,) in self.db.execute("SELECT idx FROM rows WHERE live = 1"):
+                self.live[idx] = True
+            self.build_ann()
+
+    @property
+    def ready(self) -> bool:
+        """True once a full sync completed in this process, rows kept on disk may be a partial sync."""
+        return self.synced_at is not None
+
+    def open_vectors(self, capacity: int) -> None:
+        """Map the vector file with room for capacity rows, growing the file if needed."""
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        size = capacity * self.dim * 4
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.capacity = capacity
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def build_ann(self) -> None:
+        live_ids = np.flatnonzero(self.live[:self.count])
+        if hnswlib is not None:
+            self.ann = hnswlib.Index(space="ip", dim=self.dim)
+            self.ann.init_index(max_elements=max(self.capacity, 1), ef_construction=200, M=16)
+            self.ann.set_ef(64)
+            if len(live_ids):
+                self.ann.add_items(self.vectors[live_ids], live_ids)
+        elif len(live_ids) >= self.nlist * 16:
+            self.ivf = IVFIndex(self.nlist, self.nprobe)
+            self.ivf.train(np.asarray(self.vectors[:self.count]))
+
+    def add(self, rows: list) -> None:
+        """
+        Append rows fetched from the remote table.
+        Args:
+            rows (list): dicts with row_id, body_blob, vector and metadata.
+        """
+        if not rows:
+            return
+        with self.lock:
+            if self.dim is None:
+                self.dim = len(rows[0]["vector"])
+            start = self.count
+            if start + len(rows) > self.capacity:
+                self.open_vectors(max(start + len(rows), self.capacity * 2))
+                self.live = np.concatenate([self.live, np.zeros(self.capacity - len(self.live), dtype=bool)])
+                if self.ann is not None:
+                    self.ann.resize_index(self.capacity)
+            vectors = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+            ids = np.arange(start, start + len(rows))
+            self.vectors[start:start + len(rows)] = vectors
+            self.vectors.flush()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO rows (idx, row_id, body, metadata, live) VALUES (?, ?, ?, ?, 1)",
+                [(int(idx), str(row["row_id"]), row["body_blob"], json.dumps(row.get("metadata") or {}))
+                 for idx, row in zip(ids, rows)]
+            )
+            self.db.commit()
+            self.live[ids] = True
+            self.count += len(rows)
+            self.meta_path.write_text(json.dumps({"dim": self.dim, "count": self.count}))
+            if self.ann is not None:
+                self.ann.add_items(vectors, ids)
+            elif self.ivf is not None and self.count < self.ivf.trained_size * 2:
+                self.ivf.add(vectors, ids)
+            else:
+                self.build_ann()
+
+    def remove(self, row_ids: set) -> None:
+        if not row_ids:
+            return
+        with self.lock:
+            for row_id in row_ids:
+                row = self.db.execute("SELECT idx FROM rows WHERE row_id = ?", (row_id,)).fetchone()
+                if row is None:
+                    continue
+                self.live[row[0]] = False
+                if self.ann is not None:
+                    self.ann.mark_deleted(row[0])
+            self.db.executemany("UPDATE rows SET live = 0 WHERE row_id = ?", [(row_id,) for row_id in row_ids])
+            self.db.commit()
+
+    def known_ids(self) -> set:
+        with self.lock:
+            return {row_id for (row_id,) in self.db.execute("SELECT row_id FROM rows WHERE live = 1")}
+
+    def nearest(self, query: np.ndarray, k: int, allowed: np.ndarray = None) -> List[tuple]:
+        """(idx, cosine) of the k nearest live rows, among allowed if given."""
+        if allowed is not None:
+            candidates = allowed
+        elif self.ann is not None:
+            live = int(self.live[:self.count].sum())
+            if live == 0:
+                return []
+            labels, distances = self.ann.knn_query(query, k=min(k, live))
+            return [(int(idx), 1.0 - float(dist)) for idx, dist in zip(labels[0], distances[0])]
+        elif self.ivf is not None:
+            candidates = self.ivf.candidates(query)
+        else:
+            candidates = np.arange(self.count)
+        candidates = candidates[self.live[candidates]]
+        if not len(candidates):
+            return []
+        sims = self.vectors[candidates] @ query
+        order = np.argsort(sims)[::-1][:k]
+        return [(int(candidates[i]), float(sims[i])) for i in order]
+
+    def search(self, query_vector: list, k: int, row_ids: set = None) -> List[ScoredDocument]:
+        """
+        Returns:
+            list: (document, score) pairs scored like the Cassandra cosine similarity, (1 + cos) / 2.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) + 1e-12
+        with self.lock:
+            if self.dim is None:
+                return []
+            allowed = None
+            if row_ids is not None:
+                placeholders = ",".join("?" * len(row_ids))
+                allowed = np.asarray([idx for (idx,) in self.db.execute(
+                    f"SELECT idx FROM rows WHERE row_id IN ({placeholders})", tuple(row_ids))], dtype=np.int64) \
+                    if row_ids else np.zeros(0, dtype=np.int64)
+            hits = self.nearest(query, k, allowed)
+            docs = []
+            for idx, cosine in hits:
+                row_id, body, metadata = self.db.execute(
+                    "SELECT row_id, body, metadata FROM rows WHERE idx = ?", (idx,)).fetchone()
+                docs.append((Document(page_content=body, metadata=json.loads(metadata), id=row_id), (1 + cosine) / 2))
+            return docs
+
+def diff_remote_table(table_name: str, local_ids: set, fetch_concurrency: int = 32, chunk_size: int = 1000):
+    """
+    Compare a remote vector table with a local copy.
+    Only the row ids are listed, rows missing locally are then fetched by key concurrently.
+    Yields:
+        tuple: (rows, removed) per chunk of fetched rows, rows are dicts with row_id, body_blob,
+               vector and metadata, removed is the set of local row ids deleted remotely.
+    """
+    import cassio.config
+    from cassandra.concurrent import execute_concurrent_with_args
+    from cassandra.query import SimpleStatement
+    if not re.fullmatch(r"[a-z0-9_]+", table_name):
+        raise ValueError(f"Invalid table name {table_name}")
+    session = cassio.config.resolve_session()
+    keyspace = cassio.config.resolve_keyspace()
+    remote_ids = {str(row.row_id) for row in session.execute(
+        SimpleStatement(f"SELECT row_id FROM {keyspace}.{table_name}", fetch_size=5000))}
+    removed = local_ids - remote_ids
+    missing = list(remote_ids - local_ids)
+    statement = session.prepare(f"SELECT row_id, body_blob, vector, metadata_s FROM {keyspace}.{table_name} WHERE row_id = ?")
+    for chunk_start in range(0, len(missing), chunk_size):
+        results = execute_concurrent_with_args(session, statement, [(row_id,) for row_id in missing[chunk_start:chunk_start + chunk_size]],
+                                               concurrency=fetch_concurrency, raise_on_first_error=False)
+        rows = []
+        for success, result in results:
+            if not success:
+                continue
+            for row in result:
+                rows.append({"row_id": row.row_id, "body_blob": row.body_blob,
+                             "vector": list(row.vector), "metadata": dict(row.metadata_s or {})})
+        yield rows, removed
+    if not missing:
+        yield [], removed
+
+class LocalIndexMirror:
+    """
+    Mirror selected vector tables locally and serve searches from them.
+    A background thread syncs every table each sync_interval seconds: the remote row ids are
+    listed, only rows missing locally are fetched and rows deleted remotely are dropped.
+    Tables that are not mirrored, or not synced yet, return None so the caller queries Astra.
+    """
+    def __init__(self, tables: List[str], directory: str = ".local_index", sync_interval: float = 300,
+                 nlist: int = 256, nprobe: int = 16, fetch_concurrency: int = 32):
+        self.tables = [table for table in tables if re.fullmatch(r"[a-z0-9_]+", table)]
+        self.directory = directory
+        self.sync_interval = sync_interval
+        self.fetch_concurrency = fetch_concurrency
+        self.indexes: Dict[str, LocalVectorIndex] = {
+            table: LocalVectorIndex(table, directory, nlist, nprobe) for table in self.tables
+        }
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None and self.indexes:
+                self.thread = threading.Thread(target=self.run, name="local-index-sync", daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            for table_name in self.tables:
+                try:
+                    self.sync_table(table_name)
+                except Exception as e:
+                    logger.error(f"Sync of {table_name} failed: {str(e)}")
+            time.sleep(self.sync_interval)
+
+    def sync_table(self, table_name: str) -> None:
+        index = self.indexes[table_name]
+        start = time.time()
+        local_ids = index.known_ids()
+        removed = set()
+        for rows, removed in diff_remote_table(table_name, local_ids, self.fetch_concurrency):
+            index.add(rows)
+        index.remove(removed)
+        index.synced_at = time.time()
+        logger.info(f"Synced {table_name}: {index.count} rows, -{len(removed)} removed in {time.time() - start:.2f}s")
+
+    def search(self, table_name: str, query_vector: list, k: int, row_ids: set = None) -> List[ScoredDocument] | None:
+        """
+        Returns:
+            list | None: (document, score) pairs, None if the table is not served locally.
+        """
+        index = self.indexes.get(table_name)
+        if index is None:
+            return None
+        self.start()
+        if not index.ready:
+            return None
+        return index.search(query_vector, k, row_ids)
+
+local_indexes = LocalIndexMirror(
+    [table.strip() for table in config.LOCAL_INDEX_TABLES.split(",") if table.strip()],
+    directory=config.LOCAL_INDEX_DIR,
+    sync_interval=config.LOCAL_INDEX_SYNC_INTERVAL,
+    nlist=config.LOCAL_INDEX_NLIST,
+    nprobe=config.LOCAL_INDEX_NPROBE,
+)
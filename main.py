@@ -3,6 +3,8 @@ from logger import Logger
 from agents import CasualAgent, BrowserAgent, CoderAgent, FileAgent, PlannerAgent, ReterivalAgent
 from browser import Browser, create_driver
 from llm_provider import Provider
+from provider_pool import ProviderPool
+from model_tier import ModelTier
 from interaction import Interaction
 from dotenv import load_dotenv
 
@@ -30,6 +32,8 @@ def is_running_in_docker():
 config = configparser.ConfigParser()
 config.read('config.ini')
 logger = Logger("backend.log")
+# one pool per process: circuit breakers and latency stats must outlive a single request
+provider_pool = ProviderPool.from_config(config["PROVIDER_POOL"]) if config.has_section("PROVIDER_POOL") else None
 
 def initialize_system(cid: str):
     stealth_mode = config.getboolean('BROWSER', 'stealth_mode')
@@ -57,10 +61,12 @@ def initialize_system(cid: str):
     provider = Provider(
         provider_name=config["MAIN"]["provider_name"],
         model=config["MAIN"]["provider_model"],
+        small_model=config["MAIN"].get("provider_small_model", fallback=None),
         server_address=config["MAIN"]["provider_server_address"],
-        is_local=config.getboolean('MAIN', 'is_local')
+        is_local=config.getboolean('MAIN', 'is_local'),
+        pool=provider_pool
     )
-    logger.info(f"Provider initialized: {provider.provider_name} ({provider.model})")
+    logger.info(f"Provider initialized: {provider.provider_name} ({provider.model}, small: {provider.tier_policy.models[ModelTier.SMALL]})")
 
     import random
     port = random.randint(10000, 65535)
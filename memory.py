@@ -99,8 +99,8 @@ class Memory():
         self.logger.info("Memory reset performed.")
         self.memory = memory
     
-    def push(self, role: str, content: str, context: str=None, query: str=None) -> int:
-        """Push a message to the memory."""
+    def push(self, role: str, content: str, context: str=None, query: str=None, model_used: str=None) -> int:
+        """Push a message to the memory. model_used records the model that produced an assistant message."""
         ideal_ctx = self.get_ideal_ctx(self.model_provider)
         if ideal_ctx is not None:
             if self.memory_compression and len(content) > ideal_ctx * 1.5:
@@ -110,7 +110,7 @@ class Memory():
         if self.memory[curr_idx-1]['content'] == content:
             pretty_print("Warning: same message have been pushed twice to memory", color="error")
         time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        message = {'role': role, 'content': content, 'time': time_str, 'model_used': self.model_provider}
+        message = {'role': role, 'content': content, 'time': time_str, 'model_used': model_used or self.model_provider}
         if context:
             message['context'] = context
         if query:
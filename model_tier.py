@@ -0,0 +1,79 @@
+import threading
+from enum import Enum
+from typing import Tuple
+
+from logger import Logger
+
+class ModelTier(Enum):
+    SMALL = "small"
+    LARGE = "large"
+
+class ModelTierPolicy:
+    """
+    Decide which model serves an LLM call.
+    Cheap, short calls (link selection, search query rewriting) and turns the router estimated
+    as LOW complexity go to the small model. Planning, final answers and anything unknown go to the large one.
+    The large model is the model configured on the bot (CreatingBot.model resolved through the models table)
+    when the caller passes it, the provider default model otherwise.
+    """
+    SMALL_PURPOSES = ["link_selection", "search_query"]
+    LARGE_PURPOSES = ["planning", "final_answer"]
+
+    def __init__(self, large_model: str, small_model: str = None):
+        self.models = {
+            ModelTier.LARGE: large_model,
+            ModelTier.SMALL: small_model or large_model,
+        }
+        self.small_model = small_model
+
+    def select_tier(self, purpose: str = None, complexity: str = None, large_model: str = None) -> ModelTier:
+        """
+        Args:
+            purpose (str): What the call is for, see SMALL_PURPOSES and LARGE_PURPOSES.
+            complexity (str): The router complexity estimation of the user query (LOW or HIGH).
+            large_model (str): The model configured on the bot, replaces the default large model.
+        Returns:
+            ModelTier: The selected tier.
+        """
+        large_model = large_model or self.models[ModelTier.LARGE]
+        if not self.small_model or self.small_model == large_model:
+            return ModelTier.LARGE
+        if purpose in self.LARGE_PURPOSES:
+            return ModelTier.LARGE
+        if purpose in self.SMALL_PURPOSES:
+            return ModelTier.SMALL
+        if complexity == "LOW":
+            return ModelTier.SMALL
+        return ModelTier.LARGE
+
+    def select(self, purpose: str = None, complexity: str = None, large_model: str = None) -> Tuple[ModelTier, str]:
+        tier = self.select_tier(purpose, complexity, large_model)
+        if tier == ModelTier.LARGE:
+            return tier, large_model or self.models[ModelTier.LARGE]
+        return tier, self.models[ModelTier.SMALL]
+
+class TierUsage:
+    """
+    Per call record of the tier choices, to compare latency between tiers.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.logger = Logger("model_tier.log")
+        self.totals = {}
+
+    def record(self, tier: ModelTier, model: str, purpose: str, complexity: str, latency: float) -> None:
+        self.logger.info(f"tier={tier.value} model={model} purpose={purpose} complexity={complexity} latency={latency:.3f}s")
+        with self.lock:
+            calls, total_latency = self.totals.get((tier.value, model), (0, 0.0))
+            self.totals[(tier.value, model)] = (calls + 1, total_latency + latency)
+
+    def stats(self) -> list:
+        with self.lock:
+            return [{
+                "tier": tier,
+                "model": model,
+                "calls": calls,
+                "avg_latency": total_latency / calls,
+            } for (tier, model), (calls, total_latency) in self.totals.items()]
+
+tier_usage = TierUsage()
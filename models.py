@@ -1,5 +1,5 @@
 from db import Base
-from sqlalchemy import Column, Integer, String, ARRAY, Boolean, TIMESTAMP, ForeignKey, Date, UniqueConstraint
+from sqlalchemy import Column, Integer, String, ARRAY, Boolean, TIMESTAMP, ForeignKey, Date, UniqueConstraint, Float
 from sqlalchemy.orm import relationship
 from datetime import date
 from sqlalchemy.dialects.postgresql import JSONB
@@ -75,6 +75,13 @@ class TokenMetrics(Base):
         UniqueConstraint('organization', 'usage_type', 'bot_key', 'usage_date', name='unique_usage_per_day_per_bot'),
     )
 
+class CacheInvalidation(Base):
+    __tablename__ = 'cache_invalidations'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bot_key = Column(String(255), nullable=True)  # NULL invalidates every bot
+    created_at = Column(Float, nullable=False)    # unix time, old rows are pruned
+
 class KbIndex(Base):
     __tablename__ = 'kb_index'
     
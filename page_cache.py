@@ -0,0 +1,217 @@
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import config
+from http_client import http_client
+from logger import Logger
+
+TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid", "ref_src")
+
+def normalize_url(url: str) -> str:
+    """
+    Cache key of a url: lowercase scheme and host, no default port, fragment or tracking parameters,
+    sorted query and no trailing slash.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith(TRACKING_PARAMS))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((scheme, host, path, urlencode(query), ""))
+
+def parse_domain_ttls(value: str) -> Dict[str, float]:
+    """Parse 'wikipedia.org=86400,reuters.com=600' into {domain: seconds}."""
+    ttls = {}
+    for item in value.split(","):
+        if "=" in item:
+            domain, seconds = item.split("=", 1)
+            ttls[domain.strip().lower()] = float(seconds)
+    return ttls
+
+class CachedPage:
+    def __init__(self, url: str, text: str, etag: str, last_modified: str, expires_at: float):
+        self.url = url
+        self.text = text
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at > time.time()
+
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class PageCache:
+    """
+    On-disk cache of extracted page text, shared by the web search tools and the browser.
+    Entries are keyed by normalized url and extraction variant (each tool extracts text its own way),
+    stored zlib compressed in SQLite with the ETag and Last-Modified of the response.
+    A fresh entry is served as is, an expired one is revalidated with a conditional request and only
+    refetched and parsed again when the page changed. The least recently used entries are dropped
+    when the cache grows past max_bytes.
+    """
+    def __init__(self, path: str = ".page_cache/pages.db", max_bytes: int = 256 * 1024 * 1024,
+                 default_ttl: float = 3600, domain_ttls: Dict[str, float] = None, enabled: bool = True):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.domain_ttls = domain_ttls or {}
+        self.enabled = enabled
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+        self.total_bytes = 0
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.logger = Logger("page_cache.log")
+
+    def connect(self) -> sqlite3.Connection:
+        if self.db is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    key TEXT NOT NULL,
+                    variant TEXT NOT NULL,
+                    text BLOB NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    PRIMARY KEY (key, variant)
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS pages_last_access ON pages (last_access)")
+            self.db.commit()
+            self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        return self.db
+
+    def ttl_for(self, url: str) -> float:
+        """TTL of the most specific configured domain the host belongs to, the default TTL otherwise."""
+        host = (urlsplit(url).hostname or "").lower()
+        while host:
+            if host in self.domain_ttls:
+                return self.domain_ttls[host]
+            host = host.partition(".")[2]
+        return self.default_ttl
+
+    def get(self, url: str, variant: str) -> CachedPage | None:
+        """
+        Returns:
+            CachedPage | None: The cached page, fresh or not, None if the url was never cached.
+        """
+        if not self.enabled:
+            return None
+        key = normalize_url(url)
+        with self.lock:
+            db = self.connect()
+            row = db.execute("SELECT text, etag, last_modified, expires_at FROM pages WHERE key = ? AND variant = ?",
+                             (key, variant)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE pages SET last_access = ? WHERE key = ? AND variant = ?", (time.time(), key, variant))
+            db.commit()
+        return CachedPage(url, zlib.decompress(row[0]).decode("utf-8"), row[1], row[2], row[3])
+
+    def put(self, url: str, variant: str, text: str, etag: str = None, last_modified: str = None) -> None:
+        if not self.enabled:
+            return
+        key = normalize_url(url)
+        blob = zlib.compress(text.encode("utf-8"))
+        now = time.time()
+        with self.lock:
+            db = self.connect()
+            previous = db.execute("SELECT size FROM pages WHERE key = ? AND variant = ?", (key, variant)).fetchone()
+            db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (key, variant, blob, etag, last_modified, now + self.ttl_for(url), now, len(blob)))
+            self.total_bytes += len(blob) - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            db.commit()
+
+    def touch(self, url: str, variant: str) -> None:
+        """Extend the expiry of a page the server confirmed unchanged."""
+        now = time.time()
+        with self.lock:
+            db = self.connect()
+            db.execute("UPDATE pages SET expires_at = ?, last_access = ? WHERE key = ? AND variant = ?",
+                       (now + self.ttl_for(url), now, normalize_url(url), variant))
+            db.commit()
+
+    def evict(self) -> None:
+        """Drop the least recently used pages until the cache is under 90% of max_bytes. Caller holds the lock."""
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for key, variant, size in self.db.execute("SELECT key, variant, size FROM pages ORDER BY last_access").fetchall():
+            if self.total_bytes <= target:
+                break
+            self.db.execute("DELETE FROM pages WHERE key = ? AND variant = ?", (key, variant))
+            self.total_bytes -= size
+            evicted += 1
+        self.logger.info(f"Evicted {evicted} pages, cache size {self.total_bytes / 1e6:.1f} MB")
+
+    def fetch_text(self, url: str, variant: str, extract: Callable[[str], str], headers: dict = None, **kwargs) -> str:
+        """
+        Extracted text of a page through the cache.
+        Args:
+            url (str): Page url.
+            variant (str): Name of the extraction, pages extracted differently are cached separately.
+            extract (callable): Turns the html into the text to cache.
+            headers (dict, optional): Request headers.
+            **kwargs: Passed to http_client.get (timeout...).
+        Returns:
+            str: The extracted text.
+        Raises:
+            httpx.HTTPError: When the page could not be fetched, as http_client.get and raise_for_status.
+        """
+        page = self.get(url, variant)
+        if page and page.fresh:
+            self.hits += 1
+            return page.text
+        request_headers = dict(headers or {})
+        if page:
+            request_headers.update(page.conditional_headers())
+        response = http_client.get(url, headers=request_headers, **kwargs)
+        if page and response.status_code == 304:
+            self.revalidated += 1
+            self.touch(url, variant)
+            return page.text
+        response.raise_for_status()
+        self.misses += 1
+        text = extract(response.text)
+        if "no-store" not in response.headers.get("Cache-Control", ""):
+            self.put(url, variant, text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses,
+        }
+
+page_cache = PageCache(
+    path=config.PAGE_CACHE_PATH,
+    max_bytes=int(config.PAGE_CACHE_MAX_MB * 1024 * 1024),
+    default_ttl=config.PAGE_CACHE_TTL,
+    domain_ttls=parse_domain_ttls(config.PAGE_CACHE_DOMAIN_TTLS),
+    enabled=config.PAGE_CACHE_ENABLED,
+)
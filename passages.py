@@ -0,0 +1,78 @@
+import math
+from collections import Counter
+from typing import List
+
+from text_tokens import tokenize
+
+def split_passages(text: str, max_words: int = 120) -> List[str]:
+    """
+    Group the consecutive lines of a page into passages of at most max_words words.
+    A line only starts a new passage when it does not fit, lines longer than a passage are cut.
+    """
+    passages, current, size = [], [], 0
+    for line in text.splitlines():
+        words = line.split()
+        if not words:
+            continue
+        if size + len(words) > max_words and current:
+            passages.append("\n".join(current))
+            current, size = [], 0
+        while len(words) > max_words:
+            passages.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        current.append(" ".join(words))
+        size += len(words)
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+def rank_passages(query: str, passages: List[str], k1: float = 1.2, b: float = 0.75) -> List[float]:
+    """
+    BM25 score of every passage against the query, document frequencies taken from the passages themselves.
+    Returns:
+        list: Score of each passage, in the passages order.
+    """
+    terms = set(tokenize(query))
+    tokenized = [tokenize(passage) for passage in passages]
+    if not terms or not tokenized:
+        return [0.0] * len(passages)
+    avg_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1
+    frequencies = [Counter(tokens) for tokens in tokenized]
+    idf = {}
+    for term in terms:
+        df = sum(1 for tf in frequencies if term in tf)
+        idf[term] = math.log(1 + (len(passages) - df + 0.5) / (df + 0.5))
+    scores = []
+    for tokens, tf in zip(tokenized, frequencies):
+        norm = k1 * (1 - b + b * len(tokens) / avg_length)
+        scores.append(sum(idf[term] * tf[term] * (k1 + 1) / (tf[term] + norm) for term in terms if term in tf))
+    return scores
+
+def select_passages(query: str, pages: List[List[str]], max_tokens: int, per_page: int = 4) -> List[List[int]]:
+    """
+    Pick the passages most relevant to the query across all pages until the token budget (chars/4) is spent.
+    Passages matching no query term are dropped, unless no passage matches at all: the pages are then
+    taken in search result order. Ties go to the higher ranked page and the earlier passage.
+    Args:
+        query (str): The question and search query.
+        pages (list): Passages of each page, pages in search result order.
+        max_tokens (int): Token budget of all selected passages.
+        per_page (int): Max passages taken from one page, so a single long page cannot fill the budget.
+    Returns:
+        list: Indices of the selected passages of each page, in page order.
+    """
+    flat = [(page, index, passage) for page, passages in enumerate(pages) for index, passage in enumerate(passages)]
+    scores = rank_passages(query, [passage for _, _, passage in flat])
+    order = sorted(range(len(flat)), key=lambda i: (-scores[i], flat[i][0], flat[i][1]))
+    if any(score > 0 for score in scores):
+        order = [i for i in order if scores[i] > 0]
+    selected = [[] for _ in pages]
+    used = 0
+    for i in order:
+        page, index, passage = flat[i]
+        tokens = len(passage) // 4
+        if len(selected[page]) >= per_page or used + tokens > max_tokens:
+            continue
+        selected[page].append(index)
+        used += tokens
+    return [sorted(indices) for indices in selected]
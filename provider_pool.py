@@ -0,0 +1,355 @@
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List
+
+import requests
+from dotenv import load_dotenv
+from openai import OpenAI, APIStatusError
+
+from logger import Logger
+
+DEFAULT_OPENAI_URL = "https://api.deepinfra.com/v1/openai"
+
+class ProviderUnavailable(Exception):
+    """
+    Raised when no endpoint of the pool could answer.
+    """
+    pass
+
+class Completion:
+    """
+    The text of a completion and the tokens it used.
+    """
+    def __init__(self, text: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """Rough token count (4 chars per token) for backends that do not report usage."""
+        return len(text) // 4 if text else 0
+
+class CircuitBreaker:
+    """
+    Per endpoint circuit breaker.
+    closed: requests flow. open: requests are refused until the cooldown expires.
+    half_open: a single probe request is let through, its outcome closes or re-opens the circuit.
+    """
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def is_available(self) -> bool:
+        """Like allow() but without reserving the half-open probe."""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self.probing
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+class Endpoint(ABC):
+    """
+    An upstream able to complete a chat history.
+    """
+    def __init__(self, url: str, breaker: CircuitBreaker = None, latency_window: int = 200):
+        self.url = url
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.latencies = deque(maxlen=latency_window)
+
+    @property
+    def name(self) -> str:
+        return f"{self.kind}@{self.url}"
+
+    def latency_percentile(self, percentile: float) -> float | None:
+        """Latency (seconds) at the given percentile of the recent successful calls."""
+        samples = sorted(self.latencies)
+        if not samples:
+            return None
+        idx = min(len(samples) - 1, int(len(samples) * percentile / 100))
+        return samples[idx]
+
+    @staticmethod
+    def clean_history(history: list) -> list:
+        """Keep only the fields of the chat format, Memory adds bookkeeping fields to messages."""
+        return [{'role': msg['role'], 'content': msg['content']} for msg in history]
+
+    def is_retryable(self, error: Exception) -> bool:
+        return True
+
+    @abstractmethod
+    def complete(self, model: str, history: list) -> Completion:
+        pass
+
+class OpenAIEndpoint(Endpoint):
+    """
+    Any OpenAI compatible API (DeepInfra, vLLM, llama.cpp server, ...).
+    """
+    kind = "openai"
+
+    def __init__(self, url: str, api_key: str = None, timeout: float = 120, **kwargs):
+        super().__init__(url, **kwargs)
+        # one client per endpoint so the underlying connection pool is reused across calls
+        self.client = OpenAI(api_key=api_key or "none", base_url=url, timeout=timeout, max_retries=0)
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, APIStatusError):
+            return error.status_code >= 500 or error.status_code in [408, 409, 429]
+        return True
+
+    def complete(self, model: str, history: list) -> Completion:
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=self.clean_history(history)
+        )
+        if response is None:
+            raise Exception("OpenAI response is empty.")
+        text = response.choices[0].message.content
+        if response.usage is None:
+            prompt_tokens = sum(Completion.estimate_tokens(msg['content']) for msg in history)
+            return Completion(text, prompt_tokens, Completion.estimate_tokens(text))
+        return Completion(text, response.usage.prompt_tokens, response.usage.completion_tokens)
+
+class ServerEndpoint(Endpoint):
+    """
+    A self-hosted llm_server instance (see llm_server/app.py).
+    The output is read from the /stream server-sent events instead of polling.
+    """
+    kind = "server"
+
+    def __init__(self, url: str, timeout: float = 300, **kwargs):
+        url = url if url.startswith(('http://', 'https://')) else f"http://{url}"
+        super().__init__(url.rstrip('/'), **kwargs)
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def complete(self, model: str, history: list) -> Completion:
+        # the model travels with each request, the server default set by /setup is shared by every client
+        payload = {"messages": self.clean_history(history), "model": model}
+        response = self.session.post(f"{self.url}/generate", json=payload, timeout=10)
+        if response.status_code == 429:
+            raise Exception(f"{self.url} generation queue is full, try again later.")
+        response.raise_for_status()
+        generation_id = response.json()["id"]
+        deadline = time.monotonic() + self.timeout
+        chunks = []
+        event = None
+        with self.session.get(f"{self.url}/stream", params={"id": generation_id}, stream=True, timeout=(10, 60)) as events:
+            events.raise_for_status()
+            for line in events.iter_lines(decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Generation on {self.url} timed out after {self.timeout}s")
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "token":
+                        chunks.append(data["text"])
+                    elif event == "done":
+                        if data.get("error"):
+                            raise Exception(f"Generation failed on {self.url}: {data['error']}")
+                        text = "".join(chunks)
+                        prompt_tokens = sum(Completion.estimate_tokens(msg['content']) for msg in history)
+                        return Completion(text, prompt_tokens, Completion.estimate_tokens(text))
+        raise ConnectionError(f"Stream from {self.url} ended before the generation completed")
+
+class ProviderPool:
+    """
+    Spread LLM calls over several endpoints.
+    - least outstanding requests balancing between endpoints whose circuit is not open.
+    - optional hedging: if the primary has not answered after the endpoint latency percentile,
+      the same request is sent to a second endpoint and the first answer wins.
+    - retries with full jitter exponential backoff, on another endpoint when possible.
+    """
+    def __init__(self, endpoints: List[Endpoint],
+                       max_retries: int = 2,
+                       backoff_base: float = 0.5,
+                       backoff_max: float = 8.0,
+                       hedge_percentile: float = 0,
+                       hedge_min_samples: int = 20):
+        if len(endpoints) == 0:
+            raise ValueError("ProviderPool needs at least one endpoint.")
+        self.endpoints = endpoints
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(endpoints)))
+        self.logger = Logger("provider_pool.log")
+
+    @classmethod
+    def from_config(cls, section) -> "ProviderPool":
+        """
+        Build a pool from the [PROVIDER_POOL] section of config.ini.
+        endpoints is a space separated list of kind@address, kind is openai or server.
+        openai endpoints use the OPENAI_API_KEY from the .env file.
+        """
+        load_dotenv()
+        breaker_failures = section.getint('breaker_failures', fallback=5)
+        breaker_cooldown = section.getfloat('breaker_cooldown', fallback=30.0)
+        endpoints = []
+        for spec in section.get('endpoints', fallback=DEFAULT_OPENAI_URL).split():
+            kind, _, address = spec.partition('@')
+            if not address:
+                kind, address = "openai", spec
+            breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+            if kind == "openai":
+                endpoints.append(OpenAIEndpoint(address, api_key=os.getenv("OPENAI_API_KEY"), breaker=breaker))
+            elif kind == "server":
+                endpoints.append(ServerEndpoint(address, breaker=breaker))
+            else:
+                raise ValueError(f"Unknown endpoint kind {kind} in {spec}")
+        return cls(endpoints,
+                   max_retries=section.getint('max_retries', fallback=2),
+                   backoff_base=section.getfloat('backoff_base', fallback=0.5),
+                   backoff_max=section.getfloat('backoff_max', fallback=8.0),
+                   hedge_percentile=section.getfloat('hedge_percentile', fallback=0))
+
+    def pick(self, exclude: List[Endpoint] = None) -> Endpoint | None:
+        """Select the endpoint with the least outstanding requests, ties broken randomly."""
+        exclude = exclude or []
+        with self.lock:
+            candidates = [ep for ep in self.endpoints if ep not in exclude and ep.breaker.is_available()]
+            random.shuffle(candidates)
+            for endpoint in sorted(candidates, key=lambda ep: ep.outstanding):
+                if endpoint.breaker.allow():
+                    endpoint.outstanding += 1
+                    return endpoint
+        return None
+
+    def call(self, endpoint: Endpoint, model: str, history: list) -> Completion:
+        """Call a picked endpoint, pick() already counted the request as outstanding."""
+        start = time.monotonic()
+        try:
+            result = endpoint.complete(model, history)
+        except Exception as e:
+            if endpoint.is_retryable(e):
+                endpoint.breaker.record_failure()
+            else:
+                endpoint.breaker.record_success()
+            self.logger.warning(f"{endpoint.name} failed: {str(e)}")
+            raise
+        finally:
+            with self.lock:
+                endpoint.outstanding -= 1
+        endpoint.latencies.append(time.monotonic() - start)
+        endpoint.breaker.record_success()
+        return result
+
+    def hedge_delay(self, endpoint: Endpoint) -> float | None:
+        if self.hedge_percentile <= 0 or len(self.endpoints) < 2:
+            return None
+        if len(endpoint.latencies) < self.hedge_min_samples:
+            return None
+        return endpoint.latency_percentile(self.hedge_percentile)
+
+    def attempt(self, model: str, history: list, exclude: List[Endpoint]) -> Completion:
+        primary = self.pick(exclude) or self.pick()
+        if primary is None:
+            raise ProviderUnavailable("All LLM endpoints are unavailable (circuits open), try again later.")
+        delay = self.hedge_delay(primary)
+        if delay is None:
+            try:
+                return self.call(primary, model, history)
+            except Exception as e:
+                e.endpoint = primary
+                raise
+        pending = {self.executor.submit(self.call, primary, model, history): primary}
+        done, _ = wait(pending, timeout=delay)
+        if not done:
+            hedge = self.pick([primary])
+            if hedge is not None:
+                self.logger.info(f"Hedging {primary.name} after {delay:.2f}s with {hedge.name}")
+                pending[self.executor.submit(self.call, hedge, model, history)] = hedge
+        last_error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                endpoint = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    e.endpoint = endpoint
+                    last_error = e
+        raise last_error
+
+    def complete(self, model: str, history: list) -> Completion:
+        """
+        Complete the history on the pool.
+        Args:
+            model (str): Model name, must be served by every endpoint.
+            history (list): Chat messages.
+        Returns:
+            Completion: The completion and its token usage.
+        Raises:
+            ProviderUnavailable: When every attempt failed.
+        """
+        last_error = None
+        failed = []
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                # full jitter: uniform in [0, min(max, base * 2^attempt)]
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+            try:
+                return self.attempt(model, history, failed)
+            except ProviderUnavailable as e:
+                last_error = e
+            except Exception as e:
+                last_error = e
+                endpoint = getattr(e, "endpoint", None)
+                if endpoint is not None and not endpoint.is_retryable(e):
+                    raise
+                if endpoint is not None:
+                    failed.append(endpoint)
+            self.logger.warning(f"Attempt {attempt + 1}/{self.max_retries + 1} failed: {str(last_error)}")
+        raise ProviderUnavailable(f"All attempts failed, try again later. Last error: {str(last_error)}") from last_error
+
+    def status(self) -> List[dict]:
+        return [{
+            "endpoint": ep.name,
+            "circuit": ep.breaker.state,
+            "outstanding": ep.outstanding,
+            "p50": ep.latency_percentile(50),
+            "p95": ep.latency_percentile(95),
+        } for ep in self.endpoints]
@@ -0,0 +1,178 @@
+import asyncio
+import re
+import threading
+from typing import List, Tuple
+
+import numpy as np
+
+from langchain_core.documents import Document
+
+from logger import Logger
+
+ScoredDocument = Tuple[Document, float]
+
+logger = Logger("retrieval.log")
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+def merge_results(results: List[List[ScoredDocument]], top_k: int = None) -> List[ScoredDocument]:
+    """
+    Merge the per table search results into one list ordered by similarity.
+    Args:
+        results (list): (document, score) lists, one per table, higher score is more similar.
+        top_k (int, optional): Number of documents kept, all of them if None.
+    Returns:
+        list: The top_k (document, score) pairs over all tables.
+    """
+    merged = [pair for result in results for pair in result]
+    merged.sort(key=lambda pair: pair[1], reverse=True)
+    return merged[:top_k]
+
+def shingles(text: str, size: int = 5) -> set:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def remove_near_duplicates(docs: List[ScoredDocument], threshold: float = 0.85, limit: int = None) -> List[ScoredDocument]:
+    """
+    Drop documents whose word shingles overlap a better ranked document by more than threshold (Jaccard).
+    The same chunk indexed in several KBs, or overlapping chunk windows, only use the context once.
+    Stops once limit documents are kept, so it can run on the whole merged pool.
+    """
+    kept, kept_shingles = [], []
+    for doc, score in docs:
+        if limit is not None and len(kept) >= limit:
+            break
+        current = shingles(doc.page_content)
+        if any(len(current & other) / len(current | other) > threshold for other in kept_shingles if current | other):
+            continue
+        kept.append((doc, score))
+        kept_shingles.append(current)
+    return kept
+
+class CrossEncoderReranker:
+    """
+    Rescore (query, passage) pairs with a small cross-encoder on CPU.
+    The model is loaded on first use.
+    """
+    def __init__(self, model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size: int = 16):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.tokenizer = None
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        from transformers import AutoTokenizer, AutoModelForSequenceClassification
+        logger.info(f"Loading reranker {self.model_name}")
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+        self.model.eval()
+
+    def rerank(self, query: str, docs: List[ScoredDocument]) -> List[ScoredDocument]:
+        """
+        Returns:
+            list: The documents ordered by cross-encoder score, paired with that score.
+        """
+        if not docs:
+            return docs
+        import torch
+        with self.lock:
+            if self.model is None:
+                self.load()
+            scores = []
+            with torch.no_grad():
+                for i in range(0, len(docs), self.batch_size):
+                    batch = docs[i:i + self.batch_size]
+                    inputs = self.tokenizer([query] * len(batch), [doc.page_content for doc, _ in batch],
+                                            padding=True, truncation=True, max_length=512, return_tensors="pt")
+                    scores.extend(self.model(**inputs).logits.reshape(-1).tolist())
+        ranked = sorted(zip([doc for doc, _ in docs], scores), key=lambda pair: pair[1], reverse=True)
+        return ranked
+
+def pack_context(docs: List[ScoredDocument], max_tokens: int) -> str:
+    """
+    Concatenate documents in rank order while they fit in max_tokens.
+    A document too large for the remaining budget is skipped so smaller ones below it can still fit.
+    """
+    parts, used = [], 0
+    for doc, _ in docs:
+        cost = estimate_tokens(doc.page_content) + 1
+        if used + cost > max_tokens:
+            continue
+        parts.append(doc.page_content)
+        used += cost
+    return "\n\n".join(parts)
+
+def document_row_id(doc: Document) -> str | None:
+    return getattr(doc, "id", None) or doc.metadata.get("row_id")
+
+def score_rows(rows: list, query_vector: list, k: int) -> List[ScoredDocument]:
+    """
+    Score fetched vector table rows against the query like the Cassandra cosine similarity,
+    (1 + cos) / 2, so they can be merged with results of a similarity search.
+    """
+    if not rows:
+        return []
+    query = np.asarray(query_vector, dtype=np.float32)
+    vectors = np.asarray([row["vector"] for row in rows], dtype=np.float32)
+    cosine = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+    scored = [(Document(page_content=row["body_blob"], metadata=row.get("metadata") or {}, id=row["row_id"]), float((1 + c) / 2))
+              for row, c in zip(rows, cosine)]
+    scored.sort(key=lambda pair: pair[1], reverse=True)
+    return scored[:k]
+
+async def search_table(store, query_vector: list, k: int, row_ids: set = None,
+                       direct_limit: int = 64, oversample: int = 4, max_fetch: int = 1000) -> List[ScoredDocument]:
+    """
+    Similarity search in one table, restricted to row_ids when given.
+    Few row ids are fetched by primary key and scored locally, the work is then bounded by the
+    bot documents instead of the table size. Otherwise the search oversamples and keeps the rows
+    of the bot, widening the search by oversample until k rows pass the filter, the table has no
+    more rows or max_fetch rows were searched.
+    Args:
+        store: The Cassandra vector store of the table.
+        query_vector (list): Embedding of the query.
+        k (int): Number of results.
+        row_ids (set): Allowed row ids, None for no restriction.
+        direct_limit (int): Max row ids fetched by key.
+        oversample (int): Factor applied to k, then to the fetch size, when post filtering.
+        max_fetch (int): Largest similarity search sent to the store.
+    Returns:
+        list: (document, score) pairs, best first.
+    """
+    if row_ids is None:
+        return await store.asimilarity_search_with_score_by_vector(query_vector, k=k)
+    if not row_ids:
+        return []
+    if len(row_ids) <= direct_limit:
+        table = store.table
+        if hasattr(table, "aget"):
+            rows = await asyncio.gather(*(table.aget(row_id=row_id) for row_id in row_ids))
+        else:
+            rows = await asyncio.gather(*(asyncio.to_thread(table.get, row_id=row_id) for row_id in row_ids))
+        return score_rows([row for row in rows if row], query_vector, k)
+    fetch = min(k * oversample, max_fetch)
+    while True:
+        hits = await store.asimilarity_search_with_score_by_vector(query_vector, k=fetch)
+        kept = [(doc, score) for doc, score in hits if document_row_id(doc) in row_ids]
+        if len(kept) >= k or len(hits) < fetch or fetch >= max_fetch:
+            return kept[:k]
+        fetch = min(fetch * max(oversample, 2), max_fetch)
+
+def reciprocal_rank_fusion(rankings: List[List[ScoredDocument]], k: int = 60) -> List[ScoredDocument]:
+    """
+    Fuse rankings of different scorers (vector, BM25) by summing 1 / (k + rank) per document.
+    Documents are matched by row id, or by content when they have none.
+    Returns:
+        list: (document, fused score) pairs, best first.
+    """
+    fused, docs = {}, {}
+    for ranking in rankings:
+        for rank, (doc, _) in enumerate(ranking, start=1):
+            key = document_row_id(doc) or doc.page_content
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    return sorted(((docs[key], score) for key, score in fused.items()), key=lambda pair: pair[1], reverse=True)
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import threading
+import time
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import config
+from answer_cache import answer_cache
+from db import SessionLocal
+from logger import Logger
+from models import CreatingBot, KnowledgeBase, KBIndexIDs, CacheInvalidation, LLMModels
+from utility import TTLCache, remove_special_characters
+
+class RetrievalPlan:
+    """
+    Everything a retrieval request needs from Postgres for one bot.
+    """
+    def __init__(self, bot_key: str, prompt: str, default_websearch: bool,
+                 kb_ids: list[str], row_ids: dict[str, set[str]], training_files: str = None, model: str = None):
+        self.bot_key = bot_key
+        self.prompt = prompt
+        self.default_websearch = default_websearch
+        self.kb_ids = kb_ids
+        self.row_ids = row_ids
+        self.training_files = training_files
+        self.model = model
+        self.created_at = time.time()
+        self.fingerprint = self.make_fingerprint()
+
+    def make_fingerprint(self) -> str:
+        """Hash of everything an answer depends on: prompt, model, web search flag, training files and indexed rows."""
+        payload = json.dumps([
+            self.prompt,
+            self.model,
+            self.default_websearch,
+            self.training_files,
+            sorted(self.kb_ids),
+            sorted((table, sorted(ids)) for table, ids in self.row_ids.items()),
+        ])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @property
+    def has_knowledge(self) -> bool:
+        return bool(self.kb_ids)
+
+class RetrievalPlanCache:
+    """
+    Read-through cache of the retrieval plan of each bot.
+    A miss runs the CreatingBot, KnowledgeBase and KBIndexIDs queries once, then requests of the
+    same bot are served from memory until the plan expires or is invalidated after the bot or its
+    knowledge bases change.
+    Every API worker process holds its own cache, invalidations are written to the cache_invalidations
+    table and a background thread of each process applies the new rows every sync_interval seconds,
+    so a cache hit never touches the database.
+    """
+    def __init__(self, ttl: float = 300, max_entries: int = 1024, sync_interval: float = 2, retention: float = 86400,
+                 session_factory=SessionLocal):
+        self.plans = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.sync_interval = sync_interval
+        self.retention = retention
+        self.session_factory = session_factory
+        self.last_seen = None
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.logger = Logger("retrieval_plan.log")
+
+    def get(self, bot_key: str, db: Session) -> RetrievalPlan | None:
+        """
+        Returns:
+            RetrievalPlan | None: The plan of the bot, None if the bot key is unknown.
+        """
+        plan = self.plans.get(bot_key)
+        if plan is None:
+            plan = self.resolve(bot_key, db)
+            if plan is not None:
+                self.plans.put(bot_key, plan)
+        return plan
+
+    def resolve(self, bot_key: str, db: Session) -> RetrievalPlan | None:
+        api = db.query(CreatingBot).filter(CreatingBot.apikey == bot_key).first()
+        if api is None:
+            return None
+        kb_ids, row_ids = [], {}
+        if api.training_files:
+            data = db.query(KnowledgeBase).filter(KnowledgeBase.id.in_([int(i) for i in api.training_files.split(",")])).all()
+            kb_ids = list(set(kb.kb_id for kb in data if kb.kb_id is not None))
+            doc_names = [d.file_name for d in data if d.file_name is not None]
+            row_ids = self.resolve_row_ids(db, bot_key, api.organization, kb_ids, doc_names)
+        model = self.resolve_model(db, bot_key, api.model)
+        self.logger.info(f"Resolved retrieval plan of {bot_key}: {len(kb_ids)} knowledge bases, {len(row_ids)} indexed tables, model {model}")
+        return RetrievalPlan(bot_key, api.prompt, bool(api.default_websearch), kb_ids, row_ids, api.training_files, model)
+
+    def resolve_model(self, db: Session, bot_key: str, model_name: str | None) -> str | None:
+        """
+        Provider model id of the model configured on the bot, None to use the provider default model.
+        """
+        if not model_name:
+            return None
+        model_id = db.query(LLMModels.model_id).filter(LLMModels.model_name == model_name).limit(1).scalar()
+        if model_id is None:
+            self.logger.warning(f"Model {model_name} of {bot_key} is not in the models table, using the default model")
+        return model_id
+
+    def resolve_row_ids(self, db: Session, bot_key: str, organization: str, kb_ids: list[str],
+                        doc_names: list[str]) -> dict[str, set[str]]:
+        """
+        Vector row ids of the bot documents grouped by table.
+        Tables are named like get_table_names() names them, and only rows of the organization stored
+        in the tables of the bot knowledge bases are kept, documents of other organizations may share
+        a file name.
+        """
+        tables = {remove_special_characters(f"{organization}_{kb}") for kb in kb_ids if kb != "private"}
+        rows = db.query(KBIndexIDs.table_name, KBIndexIDs.index_ids) \
+            .filter(KBIndexIDs.file_name.in_(doc_names), KBIndexIDs.organization == organization).all()
+        row_ids = {}
+        for table_name, index_ids in rows:
+            if not table_name or not index_ids:
+                continue
+            table_name = remove_special_characters(table_name)
+            private = table_name.startswith("private_") and "private" in kb_ids
+            if table_name not in tables and not private:
+                self.logger.warning(f"Ignoring row ids of {bot_key} in {table_name}, not a table of its knowledge bases")
+                continue
+            row_ids.setdefault(table_name, set()).update(str(row_id) for row_id in index_ids)
+        for table_name in sorted(tables - row_ids.keys()):
+            self.logger.warning(f"No row ids of {bot_key} in {table_name}, its search is not restricted to the bot documents")
+        return row_ids
+
+    def start(self) -> None:
+        """
+        Create the cache_invalidations table if needed and start applying the invalidations of the
+        other processes. Called once at startup.
+        """
+        if self.thread is not None:
+            return
+        db = self.session_factory()
+        try:
+            CacheInvalidation.__table__.create(bind=db.get_bind(), checkfirst=True)
+        finally:
+            db.close()
+        self.sync()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="retrieval-plan-sync")
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.sync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        """Apply the invalidations other processes recorded since the last sync."""
+        db = self.session_factory()
+        try:
+            if self.last_seen is None:
+                # nothing is cached yet, only the rows recorded from now on matter
+                self.last_seen = db.query(func.coalesce(func.max(CacheInvalidation.id), 0)).scalar()
+                return
+            rows = db.query(CacheInvalidation.id, CacheInvalidation.bot_key) \
+                .filter(CacheInvalidation.id > self.last_seen).order_by(CacheInvalidation.id).all()
+        except SQLAlchemyError as e:
+            self.logger.warning(f"Reading cache invalidations failed: {str(e)}")
+            return
+        finally:
+            db.close()
+        for row_id, bot_key in rows:
+            self.drop(bot_key)
+            self.last_seen = row_id
+
+    def drop(self, bot_key: str = None) -> None:
+        """Drop the cached plan and answers of a bot in this process, every bot if no bot key is given."""
+        self.plans.invalidate(bot_key)
+        answer_cache.invalidate(bot_key)
+        self.logger.info(f"Invalidated retrieval plan of {bot_key or 'every bot'}")
+
+    def invalidate(self, bot_key: str = None, db: Session = None) -> None:
+        """
+        Drop the plan and cached answers of a bot, or of every bot if no bot key is given.
+        Args:
+            bot_key (str, optional): The bot whose plan changed.
+            db (Session, optional): Records the invalidation for the other processes, this process only if None.
+        """
+        if db is not None:
+            now = time.time()
+            db.add(CacheInvalidation(bot_key=bot_key, created_at=now))
+            db.query(CacheInvalidation).filter(CacheInvalidation.created_at < now - self.retention).delete()
+            db.commit()
+        self.drop(bot_key)
+
+retrieval_plans = RetrievalPlanCache(ttl=config.RETRIEVAL_PLAN_TTL, sync_interval=config.RETRIEVAL_PLAN_SYNC_INTERVAL)
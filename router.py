@@ -30,6 +30,7 @@ class AgentRouter:
         self.learn_few_shots_tasks()
         self.learn_few_shots_complexity()
         self.asked_clarify = False
+        self.last_complexity = None
     
     def load_pipelines(self) -> Dict[str, Type[pipeline]]:
         """
@@ -486,6 +487,7 @@ class AgentRouter:
             Agent: The selected agent
         """
         assert len(self.agents) > 0, "No agents available."
+        self.last_complexity = None
         if len(self.agents) == 1:
             return self.agents[0]
         lang = self.lang_analysis.detect_language(text)
@@ -493,6 +495,7 @@ class AgentRouter:
         text = self.lang_analysis.translate(text, lang)
         labels = [agent.role for agent in self.agents]
         complexity = self.estimate_complexity(text)
+        self.last_complexity = complexity
         if complexity == "HIGH":
             pretty_print(f"Complex task detected, routing to planner agent.", color="info")
             return self.find_planner_agent()
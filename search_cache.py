@@ -0,0 +1,109 @@
+import re
+from datetime import datetime, timedelta
+from typing import Callable
+
+import config
+from http_client import http_client
+from logger import Logger
+from utility import TTLCache
+
+BRAVE_SEARCH_URL = "https://api.search.brave.com/res/v1/web/search"
+# Queries with these words ask for fresh results, their Brave results get the short TTL
+FRESH_TERMS = {"today", "tonight", "yesterday", "now", "current", "currently", "latest", "live", "breaking",
+               "news", "price", "prices", "score", "scores", "weather", "forecast", "stock", "stocks", "this week"}
+
+def normalize_query(text: str) -> str:
+    """Lowercase words separated by single spaces, punctuation around words dropped."""
+    return " ".join(re.findall(r"\w+(?:[-.']\w+)*", text.lower()))
+
+class SearchCache:
+    """
+    Two level cache of web searches.
+    Questions map to the search query the LLM rewrote them into, and search queries map to the Brave
+    API results. Rewrites are kept for hours, results for minutes, and both only briefly when the
+    question asks for fresh information (news, prices, today...). Rewrites mention today's date so
+    they also expire at midnight. Shared by Websearch and the braveSearch tool.
+    """
+    def __init__(self, rewrite_ttl: float = 21600, results_ttl: float = 1800, fresh_ttl: float = 300,
+                 max_entries: int = 4096):
+        self.rewrites = TTLCache(max_entries=max_entries, ttl=rewrite_ttl)
+        self.results = TTLCache(max_entries=max_entries, ttl=results_ttl)
+        self.rewrite_ttl = rewrite_ttl
+        self.results_ttl = results_ttl
+        self.fresh_ttl = fresh_ttl
+        self.logger = Logger("search_cache.log")
+
+    @staticmethod
+    def is_fresh(query: str) -> bool:
+        normalized = normalize_query(query)
+        words = set(normalized.split())
+        return bool(words & FRESH_TERMS) or any(" " in term and term in normalized for term in FRESH_TERMS)
+
+    def results_ttl_for(self, query: str) -> float:
+        return self.fresh_ttl if self.is_fresh(query) else self.results_ttl
+
+    def rewrite_ttl_for(self, question: str) -> float:
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        ttl = self.fresh_ttl if self.is_fresh(question) else self.rewrite_ttl
+        return min(ttl, (midnight - now).total_seconds())
+
+    def rewrite(self, question: str, generate: Callable[[str], str]) -> str:
+        """
+        Search query of a question, generated once per normalized question.
+        Args:
+            question (str): The user question.
+            generate (callable): Rewrites the question, an empty result is not cached.
+        """
+        key = normalize_query(question)
+        query = self.rewrites.get(key)
+        if query is not None:
+            self.logger.info(f"Query rewrite cache hit: {query}")
+            return query
+        query = generate(question)
+        if query:
+            self.rewrites.put(key, query, ttl=self.rewrite_ttl_for(question))
+        return query
+
+    def search(self, query: str, count: int = None, api_key: str = None) -> dict:
+        """
+        Brave web search results of a query, from the cache while fresh.
+        Args:
+            query (str): The search query.
+            count (int, optional): Number of results, the Brave default if None.
+            api_key (str, optional): Brave subscription token, config.BRAVE_API_KEY if None.
+        Returns:
+            dict: The Brave JSON response.
+        Raises:
+            httpx.HTTPError: When the API call failed.
+        """
+        key = (normalize_query(query), count)
+        data = self.results.get(key)
+        if data is not None:
+            self.logger.info(f"Search results cache hit: {query}")
+            return data
+        params = {"q": query}
+        if count is not None:
+            params["count"] = count
+        headers = {
+            "Accept": "application/json",
+            "X-Subscription-Token": api_key or config.BRAVE_API_KEY
+        }
+        response = http_client.get(BRAVE_SEARCH_URL, params=params, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        self.results.put(key, data, ttl=self.results_ttl_for(query))
+        return data
+
+    def invalidate(self) -> None:
+        self.rewrites.invalidate()
+        self.results.invalidate()
+
+    def stats(self) -> dict:
+        return {"rewrites": self.rewrites.stats(), "results": self.results.stats()}
+
+search_cache = SearchCache(
+    rewrite_ttl=config.SEARCH_REWRITE_TTL,
+    results_ttl=config.SEARCH_RESULTS_TTL,
+    fresh_ttl=config.SEARCH_FRESH_TTL,
+)
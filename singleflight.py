@@ -0,0 +1,102 @@
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict
+
+from logger import Logger
+
+class InFlightCall:
+    """
+    A generation currently running on behalf of one or more callers.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    SingleFlight collapses concurrent identical calls into a single execution.
+    The first caller for a key runs the function, every caller arriving while it runs
+    waits for it and receives the same result (or the same exception).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls: Dict[str, InFlightCall] = {}
+        self.logger = Logger("singleflight.log")
+        self.executed = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(model: str, history: list) -> str:
+        """
+        Build a key for a chat request.
+        Only the role and content of each message are used, the bookkeeping fields
+        added by Memory (time, model_used, ...) differ between users and must not split the key.
+        Args:
+            model (str): The model the request is sent to.
+            history (list): The chat messages.
+        Returns:
+            str: A sha256 hex digest identifying the request.
+        """
+        messages = [(msg.get('role'), msg.get('content')) for msg in history]
+        payload = json.dumps([model, messages], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn for key, or attach to the call already running for key.
+        Args:
+            key (str): The request key.
+            fn (Callable): The function producing the result.
+        Returns:
+            Any: The result of fn.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = InFlightCall()
+                self.calls[key] = call
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+        if not leader:
+            self.logger.info(f"Attached to in-flight request {key[:12]} ({call.waiters} waiting)")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "in_flight": len(self.calls),
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+            }
+
+if __name__ == "__main__":
+    import time
+    flight = SingleFlight()
+    def slow():
+        time.sleep(1)
+        return "done"
+    threads = [threading.Thread(target=lambda: print(flight.do("k", slow))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(flight.stats())
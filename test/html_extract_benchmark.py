@@ -0,0 +1,145 @@
+"""
+Benchmark of html_extract against the BeautifulSoup extraction it replaced.
+Runs the legacy Websearch, braveSearch and Browser.get_text extraction and the new one on a saved corpus
+of pages, then reports the time per page of each parser backend and how much of the legacy output the new
+output keeps (word recall) and how much it adds (word precision).
+
+usage:
+    python test/html_extract_benchmark.py --fetch urls.txt --corpus .pages   # save the pages once
+    python test/html_extract_benchmark.py --corpus .pages
+"""
+import argparse
+import hashlib
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import html_extract
+from bs4 import BeautifulSoup
+
+def legacy_websearch(html: str) -> str:
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(['script', 'style', 'header', 'footer', 'nav', 'iframe', 'noscript']):
+        element.decompose()
+    text_content = soup.get_text(separator='\n').strip()
+    lines = [line.strip() for line in text_content.splitlines() if line.strip()]
+    return '\n'.join(lines)
+
+def legacy_brave(html: str) -> str:
+    soup = BeautifulSoup(html, 'html.parser')
+    for script in soup(["script", "style"]):
+        script.extract()
+    text = soup.get_text()
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+def is_sentence(text: str) -> bool:
+    """Browser.is_sentence, copied so the benchmark runs without selenium."""
+    text = text.strip()
+    if any(c.isdigit() for c in text):
+        return True
+    words = re.findall(r'\w+', text, re.UNICODE)
+    word_count = len(words)
+    has_punctuation = any(text.endswith(p) for p in ['.', '，', ',', '!', '?', '。', '！', '？', '।', '۔'])
+    is_long_enough = word_count > 4
+    return (word_count >= 5 and (has_punctuation or is_long_enough))
+
+def legacy_browser(html: str) -> str:
+    import markdownify
+    soup = BeautifulSoup(html, 'html.parser')
+    for element in soup(['script', 'style', 'noscript', 'meta', 'link']):
+        element.decompose()
+    markdown_converter = markdownify.MarkdownConverter(
+        heading_style="ATX",
+        strip=['a'],
+        autolinks=False,
+        bullets='•',
+        strong_em_symbol='*',
+        default_title=False,
+    )
+    markdown_text = markdown_converter.convert(str(soup.body))
+    lines = []
+    for line in markdown_text.splitlines():
+        stripped = line.strip()
+        if stripped and is_sentence(stripped):
+            lines.append(' '.join(stripped.split()))
+    result = "[Start of page]\n\n" + "\n\n".join(lines) + "\n\n[End of page]"
+    return re.sub(r'!\[(.*?)\]\(.*?\)', r'[IMAGE: \1]', result)[:32768]
+
+def new_browser(html: str, backend: str) -> str:
+    lines = html_extract.extract_markdown(html, keep=is_sentence, max_chars=32768, backend=backend)
+    return ("[Start of page]\n\n" + "\n\n".join(lines) + "\n\n[End of page]")[:32768]
+
+def words(text: str) -> Counter:
+    return Counter(re.findall(r"\w+", text.lower()))
+
+def overlap(legacy: str, new: str) -> tuple:
+    """Word recall and precision of the new output against the legacy one."""
+    a, b = words(legacy), words(new)
+    common = sum((a & b).values())
+    return common / max(sum(a.values()), 1), common / max(sum(b.values()), 1)
+
+def fetch_corpus(urls_file: str, corpus: Path) -> None:
+    from http_client import http_client
+    corpus.mkdir(parents=True, exist_ok=True)
+    for url in Path(urls_file).read_text().split():
+        try:
+            response = http_client.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=15)
+            response.raise_for_status()
+        except Exception as e:
+            print(f"skip {url}: {e}")
+            continue
+        name = hashlib.sha1(url.encode()).hexdigest()[:16] + ".html"
+        (corpus / name).write_text(response.text, encoding="utf-8")
+        print(f"saved {url} -> {name}")
+
+def timed(fn, pages: list, repeat: int) -> tuple:
+    outputs = [fn(page) for page in pages]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            fn(page)
+    elapsed = (time.perf_counter() - start) / (repeat * len(pages))
+    return outputs, elapsed
+
+def main(args):
+    corpus = Path(args.corpus)
+    if args.fetch:
+        fetch_corpus(args.fetch, corpus)
+    pages = [path.read_text(encoding="utf-8", errors="replace") for path in sorted(corpus.glob("*.html"))]
+    if not pages:
+        sys.exit(f"No .html pages in {corpus}, save some with --fetch urls.txt")
+    size_mb = sum(len(page.encode("utf-8")) for page in pages) / 1e6
+    print(f"{len(pages)} pages, {size_mb:.1f} MB, backends: {', '.join(b for b in args.backends)}\n")
+    backends = [b for b in args.backends if b == "bs4" or
+                (b == "selectolax" and html_extract.LexborHTMLParser) or (b == "lxml" and html_extract.lxml)]
+
+    cases = [
+        ("websearch", legacy_websearch, lambda backend: lambda page: html_extract.extract_text(page, backend=backend)),
+        ("brave", legacy_brave, lambda backend: lambda page: html_extract.extract_text(page, backend=backend)),
+        ("browser", legacy_browser, lambda backend: lambda page: new_browser(page, backend)),
+    ]
+    print(f"{'case':<11}{'extractor':<13}{'ms/page':>10}{'speedup':>10}{'recall':>9}{'precision':>11}")
+    for name, legacy, make in cases:
+        legacy_outputs, legacy_time = timed(legacy, pages, args.repeat)
+        print(f"{name:<11}{'legacy':<13}{legacy_time * 1000:>10.2f}{1:>10.1f}")
+        for backend in backends:
+            outputs, elapsed = timed(make(backend), pages, args.repeat)
+            scores = [overlap(old, new) for old, new in zip(legacy_outputs, outputs)]
+            recall = sum(score[0] for score in scores) / len(scores)
+            precision = sum(score[1] for score in scores) / len(scores)
+            print(f"{'':<11}{backend:<13}{elapsed * 1000:>10.2f}{legacy_time / elapsed:>10.1f}{recall:>9.3f}{precision:>11.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTML extraction benchmark")
+    parser.add_argument("--corpus", type=str, default=".pages", help="directory of saved .html pages")
+    parser.add_argument("--fetch", type=str, default=None, help="file of urls to save into the corpus first")
+    parser.add_argument("--backends", nargs="+", default=["selectolax", "lxml", "bs4"])
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
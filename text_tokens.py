@@ -0,0 +1,10 @@
+import re
+from typing import List
+
+TOKEN_PATTERN = re.compile(r"\w+(?:[-.]\w+)*")
+STOPWORDS = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is", "it",
+             "of", "on", "or", "that", "the", "this", "to", "was", "were", "what", "with"}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words, identifiers like sku-123 or v2.1 are kept whole."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
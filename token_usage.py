@@ -0,0 +1,122 @@
+import atexit
+import threading
+from datetime import date
+from typing import Dict, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+
+import config
+from db import SessionLocal
+from logger import Logger
+from models import TokenMetrics
+
+class TokenUsageRecorder:
+    """
+    Aggregate token usage in memory and write it to TokenMetrics in the background.
+    record() only touches a dict under a lock, the database is written by a daemon thread
+    every flush_interval seconds with a single batched INSERT ... ON CONFLICT DO UPDATE,
+    so accounting never adds a database round-trip to a request.
+    Callers served by another caller's in-flight generation (see SingleFlight) are not billed,
+    they are only counted per key in coalesced and reported in the flush log.
+    """
+    def __init__(self, flush_interval: float = 30.0, session_factory=SessionLocal):
+        self.flush_interval = flush_interval
+        self.session_factory = session_factory
+        self.lock = threading.Lock()
+        self.pending: Dict[Tuple[str, str, str, date], Dict[str, int]] = {}
+        self.coalesced: Dict[Tuple[str, str, str, date], int] = {}
+        self.logger = Logger("token_usage.log")
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def record(self, organization: str, usage_type: str, bot_key: str,
+                     chat_tokens: int = 0, embed_tokens: int = 0, api_calls: int = 1) -> None:
+        """
+        Add usage to the in memory aggregate of (organization, usage_type, bot_key, today).
+        Args:
+            organization (str): Organization of the user.
+            usage_type (str): 'chat' or 'knowledge_base'.
+            bot_key (str): The bot api key, empty for direct chats.
+            chat_tokens (int): Prompt plus completion tokens.
+            embed_tokens (int): Tokens sent to the embedding model.
+            api_calls (int): Number of upstream calls.
+        """
+        key = (organization or "", usage_type, bot_key or "", date.today())
+        with self.lock:
+            counters = self.pending.setdefault(key, {"chat_tokens": 0, "embed_tokens": 0, "api_calls": 0})
+            counters["chat_tokens"] += chat_tokens
+            counters["embed_tokens"] += embed_tokens
+            counters["api_calls"] += api_calls
+            if self.thread is None:
+                self.start()
+
+    def record_coalesced(self, organization: str, usage_type: str, bot_key: str) -> None:
+        """
+        Count a call answered by a coalesced generation, no tokens or api calls are charged.
+        """
+        key = (organization or "", usage_type, bot_key or "", date.today())
+        with self.lock:
+            self.coalesced[key] = self.coalesced.get(key, 0) + 1
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True, name="token-usage-flush")
+        self.thread.start()
+        atexit.register(self.close)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self) -> None:
+        self.stop_event.set()
+        self.flush()
+
+    def flush(self) -> int:
+        """
+        Upsert every pending aggregate in one statement.
+        On failure the counters are merged back so the next flush retries them.
+        Returns:
+            int: Number of rows written.
+        """
+        with self.lock:
+            batch, self.pending = self.pending, {}
+            coalesced, self.coalesced = self.coalesced, {}
+        for (organization, usage_type, bot_key, usage_date), count in coalesced.items():
+            self.logger.info(f"Coalesced calls of {organization}/{usage_type}/{bot_key} on {usage_date}: {count}")
+        if not batch:
+            return 0
+        rows = [{
+            "organization": organization,
+            "usage_type": usage_type,
+            "bot_key": bot_key,
+            "usage_date": usage_date,
+            **counters
+        } for (organization, usage_type, bot_key, usage_date), counters in batch.items()]
+        stmt = insert(TokenMetrics).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            constraint='unique_usage_per_day_per_bot',
+            set_={
+                "chat_tokens": TokenMetrics.chat_tokens + stmt.excluded.chat_tokens,
+                "embed_tokens": TokenMetrics.embed_tokens + stmt.excluded.embed_tokens,
+                "api_calls": TokenMetrics.api_calls + stmt.excluded.api_calls,
+            }
+        )
+        db = self.session_factory()
+        try:
+            db.execute(stmt)
+            db.commit()
+            self.logger.info(f"Flushed {len(rows)} token usage rows.")
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            self.logger.error(f"Token usage flush failed, will retry: {str(e)}")
+            with self.lock:
+                for key, counters in batch.items():
+                    merged = self.pending.setdefault(key, {"chat_tokens": 0, "embed_tokens": 0, "api_calls": 0})
+                    for field, value in counters.items():
+                        merged[field] += value
+            return 0
+        finally:
+            db.close()
+
+usage_recorder = TokenUsageRecorder(flush_interval=config.TOKEN_METRICS_FLUSH_INTERVAL)
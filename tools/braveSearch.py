@@ -1,4 +1,4 @@
-import requests
+import httpx
 import os
 
 if __name__ == "__main__":
@@ -6,7 +6,9 @@ if __name__ == "__main__":
     sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from tools.tools import Tools
-from bs4 import BeautifulSoup
+from page_cache import page_cache
+from html_extract import extract_text
+from search_cache import search_cache
 
 class braveSearch(Tools):
     def __init__(self, api_key: str = None):
@@ -25,23 +27,14 @@ class braveSearch(Tools):
 
     def get_page_content(self, url: str) -> str:
         """
-        Get the text content of a single page using requests and BeautifulSoup.
+        Get the text content of a single page through the shared page cache.
         """
         try:
             headers = {
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.36'
             }
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for script in soup(["script", "style"]):
-                script.extract()
-            text = soup.get_text()
-            lines = (line.strip() for line in text.splitlines())
-            chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-            text = '\n'.join(chunk for chunk in chunks if chunk)
-            return text
-        except requests.exceptions.RequestException as e:
+            return page_cache.fetch_text(url, "text", extract_text, headers=headers, timeout=10)
+        except httpx.HTTPError as e:
             return f"Error getting page content for {url}: {e}"
 
     def execute(self, blocks: list, safety: bool = False) -> str:
@@ -53,17 +46,8 @@ class braveSearch(Tools):
         if not query:
             return "Error: Empty search query provided."
 
-        headers = {
-            "Accept": "application/json",
-            "X-Subscription-Token": self.api_key
-        }
-        params = {
-            "q": query
-        }
         try:
-            response = requests.get(self.base_url, headers=headers, params=params)
-            response.raise_for_status()
-            search_results = response.json()
+            search_results = search_cache.search(query, api_key=self.api_key)
             results = []
             if "web" in search_results and "results" in search_results["web"]:
                 for result in search_results["web"]["results"][:3]: # Get top 3 results
@@ -72,7 +56,7 @@ class braveSearch(Tools):
             if len(results) == 0:
                 return "No search results, web search failed."
             return "\n\n".join(results)
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise Exception(f"Brave Search API request failed: {e}") from e
 
     def execution_failure_check(self, output: str) -> bool:
@@ -1,3 +1,4 @@
+import httpx
 import requests
 from bs4 import BeautifulSoup
 import os
@@ -7,6 +8,7 @@ if __name__ == "__main__": # if running as a script for individual testing
     sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from tools.tools import Tools
+from http_client import http_client
 
 class searxSearch(Tools):
     def __init__(self, base_url: str = None):
@@ -33,7 +35,7 @@ class searxSearch(Tools):
         
         headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
         try:
-            response = requests.get(link, headers=headers, timeout=5)
+            response = http_client.get(link, headers=headers, timeout=5, retry=False)
             status = response.status_code
             if status == 200:
                 content = response.text.lower()
@@ -45,8 +47,8 @@ class searxSearch(Tools):
             elif status == 403:
                 return "Status: 403 Forbidden"
             else:
-                return f"Status: {status} {response.reason}"
-        except requests.exceptions.RequestException as e:
+                return f"Status: {status} {response.reason_phrase}"
+        except httpx.HTTPError as e:
             return f"Error: {str(e)}"
 
     def check_all_links(self, links):
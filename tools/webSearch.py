@@ -1,11 +1,13 @@
 
 import os
+import httpx
 import requests
 import dotenv
 
 dotenv.load_dotenv()
 
 from tools.tools import Tools
+from http_client import http_client
 from utility import animate_thinking, pretty_print
 
 """
@@ -32,7 +34,7 @@ class webSearch(Tools):
         
         headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
         try:
-            response = requests.get(link, headers=headers, timeout=5)
+            response = http_client.get(link, headers=headers, timeout=5, retry=False)
             status = response.status_code
             if status == 200:
                 content = response.text[:1000].lower()
@@ -44,8 +46,8 @@ class webSearch(Tools):
             elif status == 403:
                 return "Status: 403 Forbidden"
             else:
-                return f"Status: {status} {response.reason}"
-        except requests.exceptions.RequestException as e:
+                return f"Status: {status} {response.reason_phrase}"
+        except httpx.HTTPError as e:
             return f"Error: {str(e)}"
 
     def check_all_links(self, links):
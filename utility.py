@@ -3,6 +3,7 @@ from colorama import Fore
 from termcolor import colored
 import platform
 import threading
+from collections import OrderedDict
 import itertools
 import time
 
@@ -134,6 +135,51 @@ async def get_table_names(orgn, kbs, uid="") -> list[str]:
         for kb in kbs
     ])
 
+class TTLCache:
+    """
+    Thread safe LRU cache whose entries expire ttl seconds after insertion, or after their own TTL.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value, None if missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() > entry[0]:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl: float = None) -> None:
+        """Cache value under key for ttl seconds, the cache TTL if None."""
+        with self.lock:
+            self.entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key=None) -> None:
+        """Drop one key, or everything if no key is given."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
 if __name__ == "__main__":
     import time
     pretty_print("starting imaginary task", "success")
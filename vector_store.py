@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from typing import Callable, Dict
+
+from langchain_community.vectorstores import Cassandra
+
+import config
+from logger import Logger
+
+def cassandra_factory(table_name: str, embedding):
+    return Cassandra(
+        table_name=table_name,
+        embedding=embedding,
+        session=None,
+        keyspace="default_keyspace",
+    )
+
+class StoreHandle:
+    def __init__(self, store):
+        self.store = store
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.uses = 0
+        self.healthy = True
+
+class VectorStoreRegistry:
+    """
+    Process wide cache of vector store handles keyed by table name.
+    Building a Cassandra store reads the table schema and metadata, so each table is built once
+    and reused by every request and thread of the process. A handle is dropped when a search
+    through it fails or when it was not used for idle_ttl seconds.
+    """
+    def __init__(self, factory: Callable = cassandra_factory, idle_ttl: float = 1800):
+        self.factory = factory
+        self.idle_ttl = idle_ttl
+        self.handles: Dict[str, StoreHandle] = {}
+        self.table_locks: Dict[str, threading.Lock] = {}
+        self.lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.logger = Logger("vector_store.log")
+
+    def is_healthy(self, handle: StoreHandle) -> bool:
+        session = getattr(handle.store, "session", None)
+        return handle.healthy and not getattr(session, "is_shutdown", False)
+
+    def get(self, table_name: str, embedding):
+        """
+        Return the store of a table, building it on first use.
+        Concurrent first uses of the same table wait for a single build.
+        """
+        with self.lock:
+            self.evict_idle()
+            handle = self.handles.get(table_name)
+            if handle is not None and not self.is_healthy(handle):
+                del self.handles[table_name]
+                handle = None
+            if handle is None:
+                table_lock = self.table_locks.setdefault(table_name, threading.Lock())
+        if handle is None:
+            with table_lock:
+                with self.lock:
+                    handle = self.handles.get(table_name)
+                if handle is None:
+                    handle = StoreHandle(self.factory(table_name, embedding))
+                    with self.lock:
+                        self.handles[table_name] = handle
+                        self.created += 1
+                    self.logger.info(f"Created vector store handle for {table_name}")
+        handle.last_used = time.time()
+        handle.uses += 1
+        return handle.store
+
+    async def aget(self, table_name: str, embedding):
+        """get() without blocking the event loop while a handle is built."""
+        with self.lock:
+            handle = self.handles.get(table_name)
+            if handle is not None and self.is_healthy(handle) and time.time() - handle.last_used <= self.idle_ttl:
+                handle.last_used = time.time()
+                handle.uses += 1
+                return handle.store
+        return await asyncio.to_thread(self.get, table_name, embedding)
+
+    def invalidate(self, table_name: str = None) -> None:
+        """Mark a handle as broken after a failed search, or drop every handle if no table is given."""
+        with self.lock:
+            if table_name is None:
+                self.handles.clear()
+                return
+            handle = self.handles.pop(table_name, None)
+            if handle is not None:
+                handle.healthy = False
+                self.logger.warning(f"Invalidated vector store handle for {table_name}")
+
+    def evict_idle(self) -> None:
+        """Drop handles unused for idle_ttl seconds. Caller holds the lock."""
+        now = time.time()
+        idle = [name for name, handle in self.handles.items() if now - handle.last_used > self.idle_ttl]
+        for name in idle:
+            del self.handles[name]
+        self.evicted += len(idle)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "handles": len(self.handles),
+                "created": self.created,
+                "evicted": self.evicted,
+            }
+
+vector_stores = VectorStoreRegistry(idle_ttl=config.VECTOR_STORE_IDLE_TTL)